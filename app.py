@@ -1,12 +1,47 @@
 import os
+import json
+import atexit
+import base64
+import functools
+import gzip
+import hashlib
+import mimetypes
+import queue
+import re
 import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
-from werkzeug.security import generate_password_hash, check_password_hash
+import click
+from flask import Flask, Request, Response, request, jsonify, send_from_directory, g, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join, DEFAULT_PBKDF2_ITERATIONS
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge, ServiceUnavailable
 from datetime import datetime
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it no image variants are made
+    Image = None
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; static assets are still gzipped
+    brotli = None
+
+try:
+    import redis
+except ImportError:  # only needed for a shared response cache (CACHE_REDIS_URL)
+    redis = None
+
+try:
+    import bcrypt
+except ImportError:  # only needed to sign in accounts with old bcrypt ($2a$) hashes
+    bcrypt = None
+
 
 BASE_DIR = Path(__file__).resolve().parent
 import os
@@ -20,15 +55,99 @@ from flask_cors import CORS
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / 'data'
 DATA_DIR.mkdir(exist_ok=True)
-DB_PATH = str(DATA_DIR / 'db.sqlite')
+DB_PATH = os.environ.get('DB_PATH', str(DATA_DIR / 'db.sqlite'))
 
+# SQLite tuning, overridable from the environment
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# Negative values are KiB, positive values are pages (SQLite's convention)
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 256))
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+
+class PooledConnection(sqlite3.Connection):
+    """A connection kept open for reuse by later requests on the same thread.
+
+    Route handlers still call close() when they are done; for a pooled
+    connection that only rolls back anything left uncommitted.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+
+def connect_db(factory=sqlite3.Connection):
+    """Open a connection to DB_PATH with the configured PRAGMAs applied"""
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=SQLITE_STATEMENT_CACHE, factory=factory)
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+    conn.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
     return conn
 
 
+_thread_local = threading.local()
+
+
+def get_db():
+    """Return a database connection.
+
+    Inside a request this is the current thread's pooled connection, opened on
+    first use and handed back by release_db() when the app context ends.
+    Outside one (init_db, background work) it is a fresh connection the
+    caller must close.
+    """
+    if not has_app_context():
+        return connect_db()
+    if 'db' not in g:
+        conn = getattr(_thread_local, 'db', None)
+        if conn is None:
+            conn = _thread_local.db = connect_db(PooledConnection)
+        g.db = conn
+    return g.db
+
+
+# Largest page any paginated endpoint will return, whatever ?limit= asks for
+MAX_PAGE_SIZE = 100
+
+
+def parse_limit(value, default=None):
+    """Parse a ?limit= value, clamped to MAX_PAGE_SIZE. Returns default when absent."""
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row of a page as an opaque cursor"""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Decode a cursor from encode_cursor(); raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('invalid cursor')
+    return values
+
+
 def init_db():
     db = get_db()
     cur = db.cursor()
@@ -172,17 +291,1009 @@ def init_db():
             db3.commit()
         except Exception:
             pass
-    
+
+    apply_migrations(db3)
+
+    global SEARCH_ENABLED
+    SEARCH_ENABLED = init_search_index(db3)
+
     db3.close()
 
 
-app = Flask(__name__, static_folder=str(BASE_DIR / 'public'), static_url_path='')
-CORS(app)
+# Review stats per ad computed from the reviews table itself
+REVIEW_STATS_COLUMNS = ('reviewCount', 'ratingSum', 'rating1', 'rating2', 'rating3', 'rating4', 'rating5')
+REVIEW_STATS_SQL = '''
+    SELECT adId, COUNT(*) AS reviewCount, SUM(rating) AS ratingSum,
+           SUM(rating = 1) AS rating1, SUM(rating = 2) AS rating2, SUM(rating = 3) AS rating3,
+           SUM(rating = 4) AS rating4, SUM(rating = 5) AS rating5
+    FROM reviews
+    GROUP BY adId
+'''
+# Rewrites the stored stats of every ad that disagrees with REVIEW_STATS_SQL
+REVIEW_STATS_RECONCILE = '''
+    UPDATE ads SET {assign}
+    FROM ads AS a LEFT JOIN ({stats}) s ON s.adId = a.id
+    WHERE ads.id = a.id AND ({differs})
+'''.format(
+    assign=', '.join(f'{c} = COALESCE(s.{c}, 0)' for c in REVIEW_STATS_COLUMNS),
+    stats=REVIEW_STATS_SQL,
+    differs=' OR '.join(f'a.{c} IS NOT COALESCE(s.{c}, 0)' for c in REVIEW_STATS_COLUMNS),
+)
+# Rewrites the stored wishlistCount of every ad that disagrees with the wishlist table
+WISHLIST_COUNT_RECONCILE = '''
+    UPDATE ads SET wishlistCount = COALESCE(w.saves, 0)
+    FROM ads AS a LEFT JOIN (SELECT adId, COUNT(*) AS saves FROM wishlist GROUP BY adId) w ON w.adId = a.id
+    WHERE ads.id = a.id AND a.wishlistCount IS NOT COALESCE(w.saves, 0)
+'''
+
+
+# Recomputes every conversation's last message and unread counters from messages
+CONVERSATION_SUMMARY_REBUILD = '''
+    UPDATE conversations SET
+        lastMessageId = (SELECT MAX(id) FROM messages WHERE conversationId = conversations.id),
+        lastMessageAt = (SELECT createdAt FROM messages WHERE id =
+            (SELECT MAX(id) FROM messages WHERE conversationId = conversations.id)),
+        buyerUnread = (SELECT COUNT(*) FROM messages WHERE conversationId = conversations.id
+                       AND senderId != conversations.buyerId AND isRead = 0),
+        sellerUnread = (SELECT COUNT(*) FROM messages WHERE conversationId = conversations.id
+                        AND senderId != conversations.sellerId AND isRead = 0)
+'''
+# Each user's unread total, summed from their side of every conversation
+USER_UNREAD_SQL = '''
+    SELECT userId, SUM(unread) AS unreadCount FROM (
+        SELECT buyerId AS userId, buyerUnread AS unread FROM conversations
+        UNION ALL
+        SELECT sellerId, sellerUnread FROM conversations WHERE sellerId != buyerId
+    )
+    GROUP BY userId
+    HAVING SUM(unread) > 0
+'''
+
+# Upload URLs an ad row (NEW/OLD) references: imageUrl plus `images`, which
+# holds a JSON list of URLs or, on older rows, a single bare URL
+def ad_upload_match(row):
+    return (f"url = {row}.imageUrl OR url IN (SELECT value FROM json_each(CASE WHEN json_valid({row}.images) "
+            f"THEN {row}.images ELSE json_quote({row}.images) END))")
+
+
+# Triggers keeping uploads.refCount equal to the number of ads and users
+# pointing at each stored file
+UPLOAD_REFCOUNT_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS uploads_ads_insert AFTER INSERT ON ads BEGIN
+        UPDATE uploads SET refCount = refCount + 1 WHERE {ad_upload_match('NEW')};
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS uploads_ads_delete AFTER DELETE ON ads BEGIN
+        UPDATE uploads SET refCount = refCount - 1 WHERE {ad_upload_match('OLD')};
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS uploads_ads_update AFTER UPDATE OF imageUrl, images ON ads BEGIN
+        UPDATE uploads SET refCount = refCount - 1 WHERE {ad_upload_match('OLD')};
+        UPDATE uploads SET refCount = refCount + 1 WHERE {ad_upload_match('NEW')};
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS uploads_users_insert AFTER INSERT ON users BEGIN
+        UPDATE uploads SET refCount = refCount + 1 WHERE url IN (NEW.logo_path, NEW.profilePicture);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS uploads_users_delete AFTER DELETE ON users BEGIN
+        UPDATE uploads SET refCount = refCount - 1 WHERE url IN (OLD.logo_path, OLD.profilePicture);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS uploads_users_update AFTER UPDATE OF logo_path, profilePicture ON users BEGIN
+        UPDATE uploads SET refCount = refCount - 1 WHERE url IN (OLD.logo_path, OLD.profilePicture);
+        UPDATE uploads SET refCount = refCount + 1 WHERE url IN (NEW.logo_path, NEW.profilePicture);
+    END''',
+]
+# Recomputes every refCount from scratch, counting each ad or user once per file
+UPLOAD_REFCOUNT_REBUILD = [
+    'UPDATE uploads SET refCount = 0',
+    '''
+    WITH refs AS (
+        SELECT 'ad' AS kind, id, imageUrl AS url FROM ads
+        UNION
+        SELECT 'ad', ads.id, j.value FROM ads, json_each(CASE WHEN json_valid(ads.images)
+            THEN ads.images ELSE json_quote(ads.images) END) j
+        UNION
+        SELECT 'user', id, logo_path FROM users
+        UNION
+        SELECT 'user', id, profilePicture FROM users
+    )
+    UPDATE uploads SET refCount = counts.n
+    FROM (SELECT url, COUNT(*) AS n FROM refs GROUP BY url) AS counts
+    WHERE counts.url = uploads.url
+    ''',
+]
+
+# Per-resource change counters behind the ETags of GET /api/ads, /api/stores
+# and /api/conversations/<id>. User columns only a login touches (password)
+# don't count as a change.
+USER_VERSIONED_COLUMNS = ('name', 'email', 'phone', 'role', 'storeName', 'businessType', 'categories',
+                          'taxNumber', 'address', 'website', 'shippingLocations', 'logo_path',
+                          'uniqueId', 'location', 'profilePicture')
+
+
+def bump_version(resource):
+    return (f"INSERT INTO resource_versions (resource, version) VALUES ({resource}, 1) "
+            "ON CONFLICT(resource) DO UPDATE SET version = version + 1;")
+
+
+RESOURCE_VERSION_TRIGGERS = [
+    *(f'''CREATE TRIGGER IF NOT EXISTS versions_ads_{event.split()[0].lower()} AFTER {event} ON ads BEGIN
+        {bump_version("'ads'")}
+    END''' for event in ('INSERT', 'UPDATE', 'DELETE')),
+    *(f'''CREATE TRIGGER IF NOT EXISTS versions_users_{event.split()[0].lower()} AFTER {event} ON users BEGIN
+        {bump_version("'users'")}
+    END''' for event in ('INSERT', f"UPDATE OF {', '.join(USER_VERSIONED_COLUMNS)}", 'DELETE')),
+    *(f'''CREATE TRIGGER IF NOT EXISTS versions_conversations_{event.lower()} AFTER {event} ON conversations BEGIN
+        {bump_version(f"'conversations:' || {row}.buyerId")}
+        {bump_version(f"'conversations:' || {row}.sellerId")}
+    END''' for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))),
+]
+
+
+# Versioned schema changes, applied in order by apply_migrations() and
+# recorded in schema_migrations. Append new versions; never edit applied ones.
+MIGRATIONS = [
+    (1, 'ads listing indexes', [
+        # Newest-first listing and its keyset cursor
+        "CREATE INDEX IF NOT EXISTS idx_ads_createdAt ON ads(createdAt, id)",
+        # The same walk restricted to one seller's ads
+        "CREATE INDEX IF NOT EXISTS idx_ads_userId ON ads(userId, createdAt, id)",
+    ]),
+    (2, 'foreign key lookup indexes', [
+        # Unread counts only ever look at unread rows
+        "CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(conversationId, senderId) WHERE isRead = 0",
+        # Finding the existing conversation between a buyer and a seller
+        "CREATE INDEX IF NOT EXISTS idx_conversations_buyer ON conversations(buyerId, sellerId)",
+        # Review lists per ad newest first; also covers the rating aggregates
+        "CREATE INDEX IF NOT EXISTS idx_reviews_adId ON reviews(adId, createdAt, rating)",
+        # A user's wishlist newest first
+        "CREATE INDEX IF NOT EXISTS idx_wishlist_user ON wishlist(userId, createdAt)",
+    ]),
+    (3, 'denormalized review stats on ads', [
+        "ALTER TABLE ads ADD COLUMN reviewCount INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ads ADD COLUMN ratingSum INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ads ADD COLUMN rating1 INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ads ADD COLUMN rating2 INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ads ADD COLUMN rating3 INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ads ADD COLUMN rating4 INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE ads ADD COLUMN rating5 INTEGER NOT NULL DEFAULT 0",
+        '''CREATE TRIGGER IF NOT EXISTS reviews_stats_insert AFTER INSERT ON reviews BEGIN
+            UPDATE ads SET reviewCount = reviewCount + 1, ratingSum = ratingSum + new.rating,
+                rating1 = rating1 + (new.rating = 1), rating2 = rating2 + (new.rating = 2),
+                rating3 = rating3 + (new.rating = 3), rating4 = rating4 + (new.rating = 4),
+                rating5 = rating5 + (new.rating = 5)
+            WHERE id = new.adId;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS reviews_stats_delete AFTER DELETE ON reviews BEGIN
+            UPDATE ads SET reviewCount = reviewCount - 1, ratingSum = ratingSum - old.rating,
+                rating1 = rating1 - (old.rating = 1), rating2 = rating2 - (old.rating = 2),
+                rating3 = rating3 - (old.rating = 3), rating4 = rating4 - (old.rating = 4),
+                rating5 = rating5 - (old.rating = 5)
+            WHERE id = old.adId;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS reviews_stats_update AFTER UPDATE OF rating, adId ON reviews BEGIN
+            UPDATE ads SET reviewCount = reviewCount - 1, ratingSum = ratingSum - old.rating,
+                rating1 = rating1 - (old.rating = 1), rating2 = rating2 - (old.rating = 2),
+                rating3 = rating3 - (old.rating = 3), rating4 = rating4 - (old.rating = 4),
+                rating5 = rating5 - (old.rating = 5)
+            WHERE id = old.adId;
+            UPDATE ads SET reviewCount = reviewCount + 1, ratingSum = ratingSum + new.rating,
+                rating1 = rating1 + (new.rating = 1), rating2 = rating2 + (new.rating = 2),
+                rating3 = rating3 + (new.rating = 3), rating4 = rating4 + (new.rating = 4),
+                rating5 = rating5 + (new.rating = 5)
+            WHERE id = new.adId;
+        END''',
+        # Backfill from the existing reviews
+        REVIEW_STATS_RECONCILE,
+    ]),
+    (4, 'live event log', [
+        '''CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            userId INTEGER,
+            type TEXT,
+            data TEXT,
+            createdAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )''',
+        # Replay for a reconnecting stream (Last-Event-ID)
+        "CREATE INDEX IF NOT EXISTS idx_events_user ON events(userId, id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_createdAt ON events(createdAt)",
+    ]),
+    (5, 'message id cursor index', [
+        # after_id / before_id paging through one conversation
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversationId, id)",
+    ]),
+    (6, 'denormalized conversation summaries', [
+        "ALTER TABLE conversations ADD COLUMN lastMessageId INTEGER",
+        "ALTER TABLE conversations ADD COLUMN lastMessageAt DATETIME",
+        # Unread messages for each participant, i.e. sent by the other one
+        "ALTER TABLE conversations ADD COLUMN buyerUnread INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE conversations ADD COLUMN sellerUnread INTEGER NOT NULL DEFAULT 0",
+        CONVERSATION_SUMMARY_REBUILD,
+        # Each side of the inbox is a range scan in last-message order
+        "CREATE INDEX IF NOT EXISTS idx_conversations_buyer_inbox ON conversations(buyerId, lastMessageAt)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_seller_inbox ON conversations(sellerId, lastMessageAt)",
+    ]),
+    (7, 'per-user unread counters', [
+        '''CREATE TABLE IF NOT EXISTS unread_counts (
+            userId INTEGER PRIMARY KEY,
+            unreadCount INTEGER NOT NULL DEFAULT 0
+        )''',
+        f"INSERT OR REPLACE INTO unread_counts (userId, unreadCount) {USER_UNREAD_SQL}",
+    ]),
+    (8, 'responsive image variants', [
+        '''CREATE TABLE IF NOT EXISTS image_variants (
+            sourceUrl TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            PRIMARY KEY (sourceUrl, width)
+        ) WITHOUT ROWID''',
+        "ALTER TABLE ads ADD COLUMN imageVariants TEXT",
+    ]),
+    (9, 'content-addressed uploads', [
+        '''CREATE TABLE IF NOT EXISTS uploads (
+            hash TEXT PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            refCount INTEGER NOT NULL DEFAULT 0,
+            createdAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_uploads_unreferenced ON uploads(createdAt) WHERE refCount <= 0",
+        *UPLOAD_REFCOUNT_TRIGGERS,
+    ]),
+    (10, 'resource versions for ETags', [
+        '''CREATE TABLE IF NOT EXISTS resource_versions (
+            resource TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID''',
+        # A random epoch keeps ETags from a recreated database from matching
+        "INSERT OR IGNORE INTO resource_versions (resource, version) VALUES ('epoch', abs(random()) % 1000000000)",
+        *RESOURCE_VERSION_TRIGGERS,
+    ]),
+    (11, 'daily ad views', [
+        '''CREATE TABLE IF NOT EXISTS ad_views_daily (
+            adId INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            views INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (adId, day)
+        ) WITHOUT ROWID''',
+        # View count flushes bump ad_views instead of ads, so only responses
+        # that include views get a new ETag
+        "DROP TRIGGER IF EXISTS versions_ads_update",
+        f'''CREATE TRIGGER versions_ads_update AFTER UPDATE ON ads WHEN OLD.views IS NEW.views BEGIN
+            {bump_version("'ads'")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS versions_ad_views AFTER UPDATE OF views ON ads
+        WHEN OLD.views IS NOT NEW.views BEGIN
+            {bump_version("'ad_views'")}
+        END''',
+    ]),
+    (12, 'store directory index', [
+        # Users from before signup recorded createdAt sort as the oldest
+        "CREATE INDEX IF NOT EXISTS idx_users_role_createdAt ON users(role, COALESCE(createdAt, ''), id)",
+    ]),
+    (13, 'denormalized wishlist counts', [
+        "ALTER TABLE ads ADD COLUMN wishlistCount INTEGER NOT NULL DEFAULT 0",
+        '''CREATE TRIGGER IF NOT EXISTS wishlist_count_insert AFTER INSERT ON wishlist BEGIN
+            UPDATE ads SET wishlistCount = wishlistCount + 1 WHERE id = new.adId;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS wishlist_count_delete AFTER DELETE ON wishlist BEGIN
+            UPDATE ads SET wishlistCount = wishlistCount - 1 WHERE id = old.adId;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS wishlist_count_update AFTER UPDATE OF adId ON wishlist BEGIN
+            UPDATE ads SET wishlistCount = wishlistCount - 1 WHERE id = old.adId;
+            UPDATE ads SET wishlistCount = wishlistCount + 1 WHERE id = new.adId;
+        END''',
+        # Backfill from the existing wishlists
+        WISHLIST_COUNT_RECONCILE,
+    ]),
+    (14, 'admin user listing index', [
+        # Admin role filter in id order; users without a role are buyers
+        "CREATE INDEX IF NOT EXISTS idx_users_admin_role ON users(COALESCE(role, 'buyer'), id)",
+    ]),
+    (15, 'cascade delete indexes', [
+        # Deleting an ad clears its wishlist rows and detaches its conversations
+        "CREATE INDEX IF NOT EXISTS idx_wishlist_adId ON wishlist(adId)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_listing ON conversations(listingId)",
+    ]),
+    (16, 'review versions for ETags', [
+        # One counter per ad, behind GET /api/reviews/<adId> and its stats
+        f'''CREATE TRIGGER IF NOT EXISTS versions_reviews_insert AFTER INSERT ON reviews BEGIN
+            {bump_version("'reviews:' || NEW.adId")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS versions_reviews_update AFTER UPDATE ON reviews BEGIN
+            {bump_version("'reviews:' || OLD.adId")}
+            {bump_version("'reviews:' || NEW.adId")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS versions_reviews_delete AFTER DELETE ON reviews BEGIN
+            {bump_version("'reviews:' || OLD.adId")}
+        END''',
+    ]),
+]
+
+
+def apply_migrations(db):
+    """Apply MIGRATIONS not yet recorded in schema_migrations, each in its own transaction"""
+    cur = db.cursor()
+    cur.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        appliedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    db.commit()
+    applied = {r[0] for r in cur.execute('SELECT version FROM schema_migrations')}
+    for version, name, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            # Explicit BEGIN: sqlite3 doesn't open a transaction for DDL on its own.
+            # IMMEDIATE takes the write lock first, so when several workers start
+            # together the ones that waited see the version recorded and skip it.
+            cur.execute('BEGIN IMMEDIATE')
+            if cur.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                db.rollback()
+                continue
+            for sql in statements:
+                cur.execute(sql)
+            cur.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+
+# Set by init_db(); False when this SQLite build has no FTS5
+SEARCH_ENABLED = False
+
+# ads_fts is keyed by ads.id (its rowid) and also indexes the seller's store
+# name, so the triggers below keep it in step with both ads and users.
+SEARCH_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS ads_fts_insert AFTER INSERT ON ads BEGIN
+        INSERT INTO ads_fts (rowid, title, description, tags, storeName)
+        VALUES (new.id, new.title, new.description, new.tags,
+                (SELECT storeName FROM users WHERE id = new.userId));
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS ads_fts_update
+    AFTER UPDATE OF title, description, tags, userId ON ads BEGIN
+        DELETE FROM ads_fts WHERE rowid = old.id;
+        INSERT INTO ads_fts (rowid, title, description, tags, storeName)
+        VALUES (new.id, new.title, new.description, new.tags,
+                (SELECT storeName FROM users WHERE id = new.userId));
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS ads_fts_delete AFTER DELETE ON ads BEGIN
+        DELETE FROM ads_fts WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS ads_fts_store_name AFTER UPDATE OF storeName ON users BEGIN
+        UPDATE ads_fts SET storeName = new.storeName
+        WHERE rowid IN (SELECT id FROM ads WHERE userId = new.id);
+    END''',
+]
+
+
+def init_search_index(db):
+    """Create the ads_fts full-text index and its triggers, backfilling it on first run"""
+    cur = db.cursor()
+    # Under the write lock, so only the first of several starting workers backfills
+    cur.execute('BEGIN IMMEDIATE')
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'ads_fts'").fetchone()
+    try:
+        cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5(
+            title, description, tags, storeName,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )''')
+    except sqlite3.OperationalError as e:
+        db.rollback()
+        print('full-text search disabled:', e)
+        return False
+    for trigger in SEARCH_TRIGGERS:
+        cur.execute(trigger)
+    if not exists:
+        cur.execute('''
+            INSERT INTO ads_fts (rowid, title, description, tags, storeName)
+            SELECT ads.id, ads.title, ads.description, ads.tags, users.storeName
+            FROM ads LEFT JOIN users ON ads.userId = users.id
+        ''')
+    db.commit()
+    return True
+
+
+def reconcile_unread_counts(db):
+    """Rebuild conversation and per-user unread counters from messages; returns how many users were off"""
+    cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    stored = dict(cur.execute('SELECT userId, unreadCount FROM unread_counts WHERE unreadCount != 0').fetchall())
+    cur.execute(CONVERSATION_SUMMARY_REBUILD)
+    actual = dict(cur.execute(USER_UNREAD_SQL).fetchall())
+    cur.execute('DELETE FROM unread_counts')
+    cur.executemany('INSERT INTO unread_counts (userId, unreadCount) VALUES (?, ?)', actual.items())
+    db.commit()
+    return sum(1 for user_id in stored.keys() | actual.keys() if stored.get(user_id) != actual.get(user_id))
+
+
+def collect_unreferenced_uploads(db, grace_hours):
+    """Delete upload records no ad or user references that are older than grace_hours.
+
+    Refcounts are rebuilt first. Files uploaded recently are kept because
+    the ad or profile that will use them may not be saved yet. Returns the
+    deleted URLs together with the URLs of their image variants.
+    """
+    cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    for sql in UPLOAD_REFCOUNT_REBUILD:
+        cur.execute(sql)
+    cur.execute("SELECT url FROM uploads WHERE refCount <= 0 AND createdAt < datetime('now', ?)",
+                (f'-{grace_hours} hours',))
+    urls = [r[0] for r in cur.fetchall()]
+    variant_urls = []
+    for url in urls:
+        cur.execute('SELECT url FROM image_variants WHERE sourceUrl = ?', (url,))
+        variant_urls.extend(r[0] for r in cur.fetchall())
+        cur.execute('DELETE FROM image_variants WHERE sourceUrl = ?', (url,))
+        cur.execute('DELETE FROM uploads WHERE url = ?', (url,))
+    db.commit()
+    return urls, variant_urls
+
+
+def reconcile_review_stats(db):
+    """Recompute the denormalized review stats on ads; returns how many ads were off"""
+    cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    cur.execute(REVIEW_STATS_RECONCILE)
+    fixed = cur.rowcount
+    db.commit()
+    return fixed
+
+
+def reconcile_wishlist_counts(db):
+    """Recompute ads.wishlistCount from the wishlist table; returns how many ads were off"""
+    cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    cur.execute(WISHLIST_COUNT_RECONCILE)
+    fixed = cur.rowcount
+    db.commit()
+    return fixed
+
+
+# public/ is served by serve() at the bottom of this file, not Flask's static route
+app = Flask(__name__, static_folder=None)
+CORS(app, expose_headers=['X-Next-Cursor'])
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    """Return the request's connection to its thread, discarding uncommitted work"""
+    conn = g.pop('db', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
 
 # Initialize DB immediately so we don't rely on server hooks that may differ across environments
 init_db()
 
 
+# ===== RESPONSE CACHE =====
+# Seconds a cached GET response may be served (0 disables caching), and how
+# many responses each process keeps
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 10))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+# Share one cache between all worker processes
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+# Response headers stored with a cached body
+CACHED_HEADERS = ('X-Next-Cursor',)
+
+
+class LocalCache:
+    """In-process LRU cache with a TTL per entry and tag invalidation.
+
+    Each entry remembers the version of the cache it was computed at.
+    Invalidating a tag stamps it with a new version, so any entry carrying
+    that tag and computed earlier is stale, including one whose query was
+    still running when the write happened.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tag_versions = {}
+        self.clock = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def version(self):
+        return self.clock
+
+    def _stale(self, tags, version):
+        return any(self.tag_versions.get(tag, (0, 0))[0] > version for tag in tags)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, tags, version, expires = entry
+            if expires < time.monotonic() or self._stale(tags, version):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags, version):
+        with self.lock:
+            if self._stale(tags, version):
+                return
+            self.entries[key] = (value, tags, version, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self.lock:
+            self.clock += 1
+            now = time.monotonic()
+            for tag in tags:
+                self.tag_versions[tag] = (self.clock, now)
+            # A stamp older than the TTL can't outdate any live entry
+            if len(self.tag_versions) > 4 * self.max_entries:
+                self.tag_versions = {t: v for t, v in self.tag_versions.items() if v[1] > now - self.ttl}
+
+    def stats(self):
+        return {'backend': 'local', 'entries': len(self.entries), 'evictions': self.evictions}
+
+
+class RedisCache:
+    """The same cache kept in Redis, so every worker sees every invalidation"""
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+
+    def version(self):
+        return int(self.client.get('cache:clock') or 0)
+
+    def _stale(self, tags, version):
+        return tags and any(int(v or 0) > version for v in self.client.mget(['cache:tag:' + t for t in tags]))
+
+    def get(self, key):
+        raw = self.client.get('cache:entry:' + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if self._stale(entry['tags'], entry['version']):
+            return None
+        return entry['body'].encode(), entry['headers']
+
+    def set(self, key, value, tags, version):
+        if self._stale(tags, version):
+            return
+        body, headers = value
+        entry = {'body': body.decode(), 'headers': headers, 'tags': tags, 'version': version}
+        self.client.set('cache:entry:' + key, json.dumps(entry), px=int(self.ttl * 1000))
+
+    def invalidate(self, tags):
+        clock = self.client.incr('cache:clock')
+        # A stamp only has to outlive the entries it can outdate, so it expires with them
+        pipe = self.client.pipeline(transaction=False)
+        for tag in tags:
+            pipe.set('cache:tag:' + tag, clock, px=int(self.ttl * 1000))
+        pipe.execute()
+
+    def stats(self):
+        return {'backend': 'redis'}
+
+
+def make_response_cache():
+    """The shared Redis cache when CACHE_REDIS_URL is set, else a per-process one"""
+    if CACHE_REDIS_URL:
+        if redis is not None:
+            return RedisCache(redis.Redis.from_url(CACHE_REDIS_URL), CACHE_TTL)
+        print('CACHE_REDIS_URL is set but the redis package is not installed; using a local cache')
+    return LocalCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+
+
+response_cache = make_response_cache()
+cache_metrics = {}
+_cache_metrics_lock = threading.Lock()
+
+
+def count_cache(endpoint, outcome):
+    with _cache_metrics_lock:
+        counts = cache_metrics.setdefault(endpoint, {'hits': 0, 'misses': 0})
+        counts[outcome] += 1
+
+
+def cached_response(tags):
+    """Cache a GET route's 200 responses, keyed by path and query string.
+
+    `tags(view_args, data)` names what the response depends on, e.g.
+    'ad:12' or 'stores'; invalidate_cache() with any of them drops it.
+    Under conditional_on() the key also carries the request's ETag, so a
+    body is only ever served with the version stamp it was built under,
+    even when the write happened in another process.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if CACHE_TTL <= 0:
+                return view(*args, **kwargs)
+            key = request.path + '?' + '&'.join(sorted(f'{k}={v}' for k, v in request.args.items(multi=True)))
+            if g.get('etag'):
+                key += '#' + g.etag
+            try:
+                hit = response_cache.get(key)
+            except Exception as e:
+                print('response cache error:', e)
+                hit = None
+            if hit is not None:
+                count_cache(request.endpoint, 'hits')
+                body, headers = hit
+                response = Response(body, mimetype='application/json', headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            count_cache(request.endpoint, 'misses')
+            version = response_cache.version()
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                body = response.get_data()
+                headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+                try:
+                    response_cache.set(key, (body, headers), sorted(tags(request.view_args, json.loads(body))), version)
+                except Exception as e:
+                    print('response cache error:', e)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_cache(*tags):
+    """Drop cached responses depending on any of `tags`; call after committing"""
+    if CACHE_TTL <= 0 or not tags:
+        return
+    try:
+        response_cache.invalidate(tags)
+    except Exception as e:
+        print('response cache error:', e)
+
+
+def user_cache_tags(cursor, user_id):
+    """Tags of cached responses that show a user's name, store or picture"""
+    cursor.execute('SELECT id FROM ads WHERE userId = ?', (user_id,))
+    tags = [f'ad:{r[0]}' for r in cursor.fetchall()]
+    cursor.execute('SELECT DISTINCT adId FROM reviews WHERE userId = ?', (user_id,))
+    tags.extend(f'reviews:{r[0]}' for r in cursor.fetchall())
+    tags.append(f'store:{user_id}')
+    return tags
+
+
+def conditional_on(resources):
+    """Answer If-None-Match with 304 from version stamps, before the view runs.
+
+    `resources(view_args)` names the resource_versions rows a response is
+    built from; the ETag is the database epoch plus their versions.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            names = ['epoch'] + list(resources(request.view_args))
+            try:
+                db = get_db()
+                cursor = db.cursor()
+                cursor.execute(f"SELECT resource, version FROM resource_versions WHERE resource IN ({','.join('?' * len(names))})", names)
+                versions = dict(cursor.fetchall())
+                db.close()
+            except Exception as e:
+                print('conditional_on error:', e)
+                return view(*args, **kwargs)
+            etag = '.'.join(str(versions.get(name, 0)) for name in names)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            # Read before the body is built, so the body is never older than its ETag
+            g.etag = etag
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def ad_resources(view_args):
+    """Version stamps behind ads responses; view counts only when they are returned"""
+    resources = ['ads', 'users']
+    try:
+        if 'views' in parse_ad_fields(request.args.get('fields')):
+            resources.append('ad_views')
+    except ValueError:
+        pass  # the view answers 400
+    return resources
+
+
+def ad_list_tags(view_args, ads):
+    """Cache tags for a list of ads: each ad, plus the collection new ads land in"""
+    tags = {f'ad:{ad["id"]}' for ad in ads}
+    if request.args.get('ids'):
+        # Ids that didn't exist yet must be refetched once they are posted
+        tags.update(f'ad:{i}' for i in parse_id_list(request.args['ids']))
+    else:
+        user_id = view_args.get('user_id') or request.args.get('userId')
+        tags.add(f'ads:user:{user_id}' if user_id else 'ads')
+    return tags
+
+
+@app.route('/api/admin/cache', methods=['GET'])
+def admin_cache_stats():
+    """Response cache hit/miss counts per route for this process"""
+    with _cache_metrics_lock:
+        routes = {endpoint: dict(counts) for endpoint, counts in cache_metrics.items()}
+    for counts in routes.values():
+        total = counts['hits'] + counts['misses']
+        counts['hitRate'] = round(counts['hits'] / total, 3) if total else 0
+    try:
+        backend = response_cache.stats()
+    except Exception as e:
+        backend = {'error': str(e)}
+    return jsonify({'success': True, 'ttl': CACHE_TTL, 'routes': routes, **backend})
+
+
+UPLOADS_DIR = BASE_DIR / 'public' / 'uploads'
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Byte limits for uploads: each file, and the whole request body
+MAX_UPLOAD_FILE_BYTES = int(os.environ.get('MAX_UPLOAD_FILE_BYTES', 15 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get('MAX_UPLOAD_REQUEST_BYTES', 100 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_REQUEST_BYTES
+# WebP widths rendered for product images, and the pool that renders them
+IMAGE_VARIANT_WIDTHS = tuple(int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',') if w)
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+
+def sniff_image_type(head):
+    """File extension for the image format the leading bytes belong to, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return '.gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+class UploadSpool:
+    """Where an uploaded file's bytes go while Werkzeug parses the request.
+
+    Chunks are written straight to a temp file in public/uploads and hashed
+    and counted on the way, so storing the upload is a rename. A file over
+    MAX_UPLOAD_FILE_BYTES aborts the request with 413.
+    """
+
+    def __init__(self):
+        UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=UPLOADS_DIR, prefix='.upload-', delete=False)
+        self.path = self.file.name
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_FILE_BYTES:
+            raise RequestEntityTooLarge(f'each file must be at most {MAX_UPLOAD_FILE_BYTES} bytes')
+        if len(self.head) < 16:
+            self.head = (self.head + data)[:16]
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    @property
+    def extension(self):
+        return sniff_image_type(self.head)
+
+    def close(self):
+        """Close the temp file and delete it unless it was stored"""
+        self.file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class UploadRequest(Request):
+    """Request that spools file uploads through UploadSpool"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = UploadSpool()
+        self.__dict__.setdefault('upload_spools', []).append(spool)
+        return spool
+
+    def close(self):
+        # Also covers spools of a request whose parsing was aborted part way
+        super().close()
+        for spool in self.__dict__.get('upload_spools', ()):
+            spool.close()
+
+
+app.request_class = UploadRequest
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Report an oversized upload as JSON like other API errors"""
+    return jsonify({'error': e.description}), 413
+
+
+def upload_spool(file):
+    """The UploadSpool holding a FileStorage's bytes (copied into one if needed)"""
+    if not isinstance(file.stream, UploadSpool):
+        spool = UploadSpool()
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+            spool.write(chunk)
+        file.stream = spool
+    return file.stream
+
+
+def save_upload(file, variants=False):
+    """Store an uploaded image under its SHA-256 and return its URL.
+
+    Identical content is kept once and a URL never changes what it serves.
+    Raises ValueError unless the bytes are a JPEG, PNG, GIF or WebP image.
+    With variants=True, thumbnails are queued for newly stored images.
+    """
+    spool = upload_spool(file)
+    if spool.extension is None:
+        raise ValueError(f'{file.filename} is not a JPEG, PNG, GIF or WebP image')
+    spool.file.close()
+    try:
+        url, created = store_upload(spool.path, spool.digest.hexdigest(), spool.size, spool.extension)
+    finally:
+        spool.close()
+    if variants and created:
+        queue_image_variants(url)
+    return url
+
+
+def store_upload(tmp_path, content_hash, size, extension):
+    """Move a hashed temp file into place unless that content is already stored.
+
+    Returns (url, created).
+    """
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('SELECT url FROM uploads WHERE hash = ?', (content_hash,))
+    row = cur.fetchone()
+    if row:
+        db.close()
+        return row['url'], False
+    filename = content_hash + extension
+    os.replace(tmp_path, UPLOADS_DIR / filename)
+    url = f"/uploads/{filename}"
+    cur.execute('INSERT OR IGNORE INTO uploads (hash, url, size) VALUES (?, ?, ?)', (content_hash, url, size))
+    created = cur.rowcount == 1
+    db.commit()
+    if not created:
+        # Another request stored the same bytes first, possibly under another extension
+        cur.execute('SELECT url FROM uploads WHERE hash = ?', (content_hash,))
+        existing = cur.fetchone()['url']
+        if existing != url:
+            os.unlink(UPLOADS_DIR / filename)
+        url = existing
+    db.close()
+    return url, created
+
+
+def render_image_variants(source, widths, quality):
+    """Write WebP copies of the image at `source`, one per width, into uploads/variants.
+
+    Runs in the image process pool. Widths larger than the original are
+    skipped, except that the smallest one is always written. Returns
+    {width: url}.
+    """
+    source = Path(source)
+    out_dir = source.parent / 'variants'
+    out_dir.mkdir(exist_ok=True)
+    variants = {}
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        for width in sorted(widths):
+            if width > img.width and variants:
+                break
+            size = (min(width, img.width), max(1, round(img.height * min(width, img.width) / img.width)))
+            name = f'{source.stem}-{width}w.webp'
+            img.resize(size, Image.LANCZOS).save(out_dir / name, 'WEBP', quality=quality)
+            variants[width] = f'/uploads/variants/{name}'
+    return variants
+
+
+def image_pool():
+    """The process pool image variants are rendered in, started on first use"""
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        return _image_pool
+
+
+def queue_image_variants(url):
+    """Render variants of an uploaded image in the background (no-op without Pillow)"""
+    if Image is None or not IMAGE_VARIANT_WIDTHS:
+        return None
+    source = UPLOADS_DIR / url.rsplit('/', 1)[-1]
+    future = image_pool().submit(render_image_variants, str(source), IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_QUALITY)
+    future.add_done_callback(lambda f: store_image_variants(url, f))
+    return future
+
+
+def store_image_variants(url, future):
+    """Record the finished variants of `url` and attach them to ads already using it"""
+    try:
+        variants = future.result()
+    except Exception as e:
+        print('image variants error:', url, e)
+        return
+    db = connect_db()
+    try:
+        cur = db.cursor()
+        cur.executemany('INSERT OR REPLACE INTO image_variants (sourceUrl, width, url) VALUES (?, ?, ?)',
+                        [(url, width, variant) for width, variant in variants.items()])
+        ad_ids = refresh_image_variants(cur, 'WHERE imageUrl = ? OR instr(images, ?) > 0', (url, url))
+        db.commit()
+        invalidate_cache(*(f'ad:{ad_id}' for ad_id in ad_ids))
+    except Exception as e:
+        print('store_image_variants error:', e)
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+def ad_image_urls(image_url, images):
+    """All image URLs of an ad: imageUrl, then `images` (a JSON list or a single URL)"""
+    urls = [image_url] if image_url else []
+    if images:
+        try:
+            parsed = json.loads(images)
+        except ValueError:
+            parsed = images
+        if isinstance(parsed, str):
+            parsed = [parsed]
+        if isinstance(parsed, list):
+            urls.extend(u for u in parsed if isinstance(u, str))
+    return list(dict.fromkeys(urls))
+
+
+def refresh_image_variants(cur, where, params=()):
+    """Rebuild ads.imageVariants ({sourceUrl: {width: url}}) for the ads matching `where`; returns their ids"""
+    ads = cur.execute(f'SELECT id, imageUrl, images FROM ads {where}', params).fetchall()
+    for ad in ads:
+        urls = ad_image_urls(ad['imageUrl'], ad['images'])
+        variants = {}
+        if urls:
+            cur.execute(f"SELECT sourceUrl, width, url FROM image_variants WHERE sourceUrl IN ({','.join('?' * len(urls))}) ORDER BY width", urls)
+            for source_url, width, url in cur.fetchall():
+                variants.setdefault(source_url, {})[str(width)] = url
+        cur.execute('UPDATE ads SET imageVariants = ? WHERE id = ?',
+                    (json.dumps(variants) if variants else None, ad['id']))
+    return [ad['id'] for ad in ads]
+
+
+def pick_image_variant(image_url, variants, width):
+    """The smallest variant of image_url at least `width` wide (else the largest), or the original"""
+    sizes = sorted((int(w), url) for w, url in (variants or {}).get(image_url, {}).items())
+    if not sizes:
+        return image_url
+    for w, url in sizes:
+        if w >= width:
+            return url
+    return sizes[-1][1]
+
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Generic file upload endpoint for images - supports multiple files"""
@@ -191,9 +1302,10 @@ def upload_file():
         if not files or len(files) == 0:
             return jsonify({'error': 'No files provided'}), 400
         
-        # Create uploads directory if it doesn't exist
-        uploads_dir = BASE_DIR / 'public' / 'uploads'
-        uploads_dir.mkdir(parents=True, exist_ok=True)
+        # Check every file's type before storing any of them
+        for file in files:
+            if file.filename and upload_spool(file).extension is None:
+                return jsonify({'error': f'{file.filename} is not a JPEG, PNG, GIF or WebP image'}), 400
         
         uploaded_urls = []
         
@@ -201,17 +1313,8 @@ def upload_file():
             if file.filename == '':
                 continue
             
-            # Generate secure filename with timestamp
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-            filename = f"{timestamp}_{filename}"
-            
-            # Save file
-            save_path = uploads_dir / filename
-            file.save(str(save_path))
-            
-            # Add URL path
-            url = f"/uploads/{filename}"
+            # Thumbnails are rendered after the response; ads pick them up when ready
+            url = save_upload(file, variants=True)
             uploaded_urls.append(url)
         
         if len(uploaded_urls) == 0:
@@ -222,6 +1325,8 @@ def upload_file():
             return jsonify({'success': True, 'url': uploaded_urls[0]})
         else:
             return jsonify({'success': True, 'urls': uploaded_urls})
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         print('upload_file error:', e)
         import traceback
@@ -229,6 +1334,130 @@ def upload_file():
         return jsonify({'error': 'Upload failed'}), 500
 
 
+# ===== PASSWORD HASHING =====
+# Werkzeug hash method (e.g. scrypt:32768:8:1 or pbkdf2:sha256:1000000) and
+# salt length for new hashes. A stored hash made with other settings is
+# replaced the next time its user logs in.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+# Processes that hash passwords, and how many hashes each web process lets
+# run or wait before answering 503
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', 32))
+# Seconds a request waits for its hash before answering 503
+PASSWORD_TIMEOUT = float(os.environ.get('PASSWORD_TIMEOUT', 10))
+
+_password_pool = None
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(PASSWORD_QUEUE_LIMIT)
+
+
+def canonical_hash_method(method):
+    """Spell out the parameters Werkzeug fills in, as they appear in stored hashes"""
+    name, *params = method.split(':')
+    defaults = {'scrypt': [str(2 ** 15), '8', '1'], 'pbkdf2': ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]}
+    return ':'.join([name, *params, *defaults.get(name, [])[len(params):]])
+
+
+CURRENT_HASH_METHOD = canonical_hash_method(PASSWORD_HASH_METHOD)
+
+
+def password_pool():
+    """The process pool passwords are hashed in, started on first use"""
+    global _password_pool
+    with _password_pool_lock:
+        if _password_pool is None:
+            _password_pool = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+        return _password_pool
+
+
+def check_password(pwhash, password):
+    """Check a password against a stored hash; runs in the password pool"""
+    if pwhash.startswith('$2'):
+        return bcrypt is not None and bcrypt.checkpw(password.encode(), pwhash.encode())
+    try:
+        return check_password_hash(pwhash, password)
+    except ValueError:  # not a hash format Werkzeug knows
+        return False
+
+
+def submit_password_job(fn, *args):
+    """Queue fn(*args) on the password pool.
+
+    Raises ServiceUnavailable when PASSWORD_QUEUE_LIMIT jobs are already
+    running or waiting, so a burst of logins is shed instead of piling up.
+    """
+    if not _password_slots.acquire(blocking=False):
+        raise ServiceUnavailable('Too many sign-ins right now, please try again')
+    try:
+        future = password_pool().submit(fn, *args)
+    except Exception:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda f: _password_slots.release())
+    return future
+
+
+def password_result(future):
+    """Wait up to PASSWORD_TIMEOUT for a password job (ServiceUnavailable after that)"""
+    try:
+        return future.result(timeout=PASSWORD_TIMEOUT)
+    except FutureTimeoutError:
+        raise ServiceUnavailable('Too many sign-ins right now, please try again')
+
+
+def hash_password(password):
+    """Hash a new password with the current settings, off the request thread"""
+    return password_result(submit_password_job(generate_password_hash, password, PASSWORD_HASH_METHOD,
+                                               PASSWORD_SALT_LENGTH))
+
+
+def verify_password(pwhash, password):
+    """Check a login attempt against a stored hash, off the request thread"""
+    return password_result(submit_password_job(check_password, pwhash or '', password))
+
+
+def password_needs_rehash(pwhash):
+    """Whether a stored hash was made with other settings than the current ones"""
+    method, _, rest = pwhash.partition('$')
+    return method != CURRENT_HASH_METHOD or len(rest.partition('$')[0]) != PASSWORD_SALT_LENGTH
+
+
+def rehash_password(user_id, old_hash, password):
+    """Replace a user's outdated hash in the background, skipped when the pool is busy"""
+    try:
+        future = submit_password_job(generate_password_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+    except ServiceUnavailable:
+        return
+    future.add_done_callback(functools.partial(store_rehashed_password, user_id, old_hash))
+
+
+def store_rehashed_password(user_id, old_hash, future):
+    """Save a new hash unless the password was changed in the meantime"""
+    try:
+        new_hash = future.result()
+    except Exception as e:
+        print('rehash error:', user_id, e)
+        return
+    db = connect_db()
+    try:
+        db.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (new_hash, user_id, old_hash))
+        db.commit()
+    except sqlite3.Error as e:
+        print('store_rehashed_password error:', e)
+    finally:
+        db.close()
+
+
+@app.errorhandler(ServiceUnavailable)
+def service_unavailable(e):
+    """Report shed load as JSON, with a hint of when to retry"""
+    response = jsonify({'error': e.description})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
 @app.route('/api/signup', methods=['POST'])
 def signup():
     # Support JSON or multipart/form-data
@@ -265,44 +1494,39 @@ def signup():
     if not email or not password:
         return jsonify({'error': 'email and password required'}), 400
 
+    # Before saving uploads, so a shed request leaves nothing behind
+    hashed = hash_password(password)
+
     # handle logo upload (for sellers)
     logo_path = None
     logo_file = files.get('logo') if files else None
     if logo_file and getattr(logo_file, 'filename', None):
-        uploads_dir = BASE_DIR / 'public' / 'uploads'
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        filename = secure_filename(logo_file.filename)
-        # prefix with timestamp to avoid collisions
-        ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-        filename = f"{ts}_{filename}"
-        save_path = uploads_dir / filename
-        logo_file.save(str(save_path))
-        logo_path = f"/uploads/{filename}"
+        try:
+            logo_path = save_upload(logo_file)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     
     # handle profile picture upload (for buyers)
     profile_picture = None
     profile_file = files.get('profilePicture') if files else None
     if profile_file and getattr(profile_file, 'filename', None):
-        uploads_dir = BASE_DIR / 'public' / 'uploads'
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        filename = secure_filename(profile_file.filename)
-        ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-        filename = f"profile_{ts}_{filename}"
-        save_path = uploads_dir / filename
-        profile_file.save(str(save_path))
-        profile_picture = f"/uploads/{filename}"
+        try:
+            profile_picture = save_upload(profile_file)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
     # Generate unique ID
     import uuid
     unique_id = 'ST' + str(uuid.uuid4())[:8].upper()
     
-    hashed = generate_password_hash(password)
     try:
         db = get_db()
         cur = db.cursor()
-        cur.execute('INSERT INTO users (name, email, password, phone, role, storeName, businessType, categories, taxNumber, address, website, shippingLocations, logo_path, uniqueId, location, profilePicture) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+        cur.execute('INSERT INTO users (name, email, password, phone, role, storeName, businessType, categories, taxNumber, address, website, shippingLocations, logo_path, uniqueId, location, profilePicture, createdAt) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,CURRENT_TIMESTAMP)',
                     (name, email, hashed, phone, role, storeName, businessType, categories, taxNumber, address, website, shipping, logo_path, unique_id, location, profile_picture))
         db.commit()
+        if role == 'seller':
+            invalidate_cache('stores')
         user_id = cur.lastrowid
         
         # Return complete user data
@@ -348,8 +1572,10 @@ def login():
         db.close()
         if not row:
             return jsonify({'error': 'invalid credentials'}), 401
-        if not check_password_hash(row['password'], password):
+        if not verify_password(row['password'], password):
             return jsonify({'error': 'invalid credentials'}), 401
+        if password_needs_rehash(row['password']):
+            rehash_password(row['id'], row['password'], password)
         
         user_data = {
             'success': True,
@@ -370,103 +1596,590 @@ def login():
             'profilePicture': row['profilePicture']
         }
         return jsonify(user_data)
+    except ServiceUnavailable:
+        raise
     except Exception as e:
         print('login error', e)
         return jsonify({'error': 'database error'}), 500
 
 
+STORES_DEFAULT_LIMIT = 20
+STORE_COLUMNS = ('id', 'name', 'email', 'storeName', 'businessType', 'categories', 'address', 'website',
+                 'logo_path', 'createdAt')
+STORE_DETAIL_COLUMNS = STORE_COLUMNS + ('location', 'shippingLocations')
+
+
+def query_stores(cur, where='', params=(), limit=None, columns=STORE_COLUMNS):
+    """Select sellers newest first, each with its listing count and rating.
+
+    The page of sellers is chosen first (idx_users_role_createdAt) and
+    only their ads are aggregated, using the review stats stored on ads.
+    """
+    limit_sql = ''
+    if limit is not None:
+        limit_sql = 'LIMIT ?'
+        params = tuple(params) + (limit,)
+    cur.execute(f'''
+        WITH page AS (
+            SELECT {', '.join(columns)} FROM users
+            WHERE role = 'seller' {where}
+            ORDER BY COALESCE(createdAt, '') DESC, id DESC
+            {limit_sql}
+        )
+        SELECT page.*, COUNT(a.id) AS listingCount,
+               COALESCE(SUM(a.reviewCount), 0) AS reviewCount,
+               CAST(SUM(a.ratingSum) AS REAL) / NULLIF(SUM(a.reviewCount), 0) AS rating
+        FROM page LEFT JOIN ads a ON a.userId = page.id
+        GROUP BY page.id
+        ORDER BY COALESCE(page.createdAt, '') DESC, page.id DESC
+    ''', params)
+    return cur.fetchall()
+
+
+def serialize_store(row):
+    """Turn a query_stores() row into the API's store dict"""
+    store = {c: row[c] for c in row.keys() if c not in ('logo_path', 'rating')}
+    store['logo'] = row['logo_path']
+    store['rating'] = round(row['rating'], 1) if row['rating'] else 0
+    return store
+
+
 @app.route('/api/stores', methods=['GET'])
+@conditional_on(lambda args: ['users', 'ads'])
+@cached_response(lambda args, stores: {'stores'} | {f'store:{s["id"]}' for s in stores})
 def get_stores():
+    """List stores (sellers), newest first, with listing count and rating.
+
+    Optional query params:
+      limit        - page size (default 20, max MAX_PAGE_SIZE)
+      cursor       - value of the X-Next-Cursor header from the previous page
+      category     - exact primary category
+      businessType - exact business type
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'), STORES_DEFAULT_LIMIT)
+        clauses = []
+        params = []
+        for arg in ('category', 'businessType'):
+            if request.args.get(arg):
+                clauses.append(f"AND {'categories' if arg == 'category' else arg} = ?")
+                params.append(request.args[arg])
+        if request.args.get('cursor'):
+            created_at, last_id = decode_cursor(request.args['cursor'], 2)
+            clauses.append("AND (COALESCE(createdAt, ''), id) < (?, ?)")
+            params.extend((created_at, last_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         db = get_db()
         cur = db.cursor()
-        cur.execute('SELECT id, name, email, storeName, businessType, categories, address, website, logo_path, createdAt FROM users WHERE role = ? ORDER BY createdAt DESC LIMIT 20', ('seller',))
-        rows = cur.fetchall()
+        rows = query_stores(cur, ' '.join(clauses), params, limit)
         db.close()
-        results = []
-        for r in rows:
-            results.append({
-                'id': r['id'],
-                'name': r['name'],
-                'email': r['email'],
-                'storeName': r['storeName'],
-                'businessType': r['businessType'],
-                'categories': r['categories'],
-                'address': r['address'],
-                'website': r['website'],
-                'logo': r['logo_path'],
-                'createdAt': r['createdAt']
-            })
-        return jsonify(results)
+        response = jsonify([serialize_store(r) for r in rows])
+        if len(rows) == limit:
+            last = rows[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last['createdAt'] or '', last['id'])
+        return response
     except Exception as e:
         print('stores error', e)
         return jsonify({'error': 'database error'}), 500
 
 
+@app.route('/api/stores/<int:store_id>', methods=['GET'])
+@conditional_on(lambda args: ['users', 'ads'])
+@cached_response(lambda args, store: {f'store:{args["store_id"]}'})
+def get_store(store_id):
+    """Get one store with its listing count and rating"""
+    try:
+        db = get_db()
+        cur = db.cursor()
+        rows = query_stores(cur, 'AND id = ?', (store_id,), columns=STORE_DETAIL_COLUMNS)
+        db.close()
+        if not rows:
+            return jsonify({'error': 'Store not found'}), 404
+        return jsonify(serialize_store(rows[0]))
+    except Exception as e:
+        print('get_store error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+
+# Fields GET /api/ads can return (and project with ?fields=), mapped to their
+# SQL over the page of ads (p), the owning user (u) and review stats (rs)
+AD_FIELDS = {
+    'id': 'p.id',
+    'title': 'p.title',
+    'description': 'p.description',
+    'userId': 'p.userId',
+    'createdAt': 'p.createdAt',
+    'author': 'u.name',
+    'storeName': 'u.storeName',
+    'role': 'u.role',
+    'profilePicture': 'u.profilePicture',
+    'category': 'p.category',
+    'tags': 'p.tags',
+    'price': 'p.price',
+    'unit': 'p.unit',
+    'minOrder': 'p.minOrder',
+    'stock': 'p.stock',
+    'imageUrl': 'p.imageUrl',
+    'images': 'p.images',
+    'imageVariants': 'p.imageVariants',
+    'verified': 'p.verified',
+    'views': 'p.views',
+    'reviewCount': 'p.reviewCount',
+    'averageRating': 'CAST(p.ratingSum AS REAL) / NULLIF(p.reviewCount, 0)',
+    'wishlistCount': 'p.wishlistCount',
+}
+AD_USER_FIELDS = {'author', 'storeName', 'role', 'profilePicture'}
+
+
+def parse_id_list(value):
+    """Parse ?ids=1,2,3 into a de-duplicated list of ints (at most MAX_PAGE_SIZE)"""
+    try:
+        ids = [int(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of integers')
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_PAGE_SIZE:
+        raise ValueError(f'at most {MAX_PAGE_SIZE} ids per request')
+    return ids
+
+
+def parse_ad_fields(value):
+    """Parse ?fields=a,b,c into a list of AD_FIELDS keys (all of them when absent)"""
+    if not value:
+        return list(AD_FIELDS)
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in AD_FIELDS]
+    if unknown:
+        raise ValueError('unknown field: ' + ', '.join(unknown))
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def parse_image_width(value):
+    """Parse ?imageWidth=N, the display width images should be sized for"""
+    if not value:
+        return None
+    try:
+        width = int(value)
+    except ValueError:
+        raise ValueError('imageWidth must be an integer')
+    if width < 1:
+        raise ValueError('imageWidth must be positive')
+    return width
+
+
+def serialize_ad(row, fields, image_width=None):
+    """Turn a row selected with AD_FIELDS aliases into the API's ad dict.
+
+    With image_width, imageUrl is swapped for its closest WebP variant.
+    """
+    ad = {}
+    for f in fields:
+        value = row[f]
+        if f in ('tags', 'imageVariants'):
+            empty = [] if f == 'tags' else {}
+            try:
+                value = json.loads(value) if value else empty
+            except ValueError:
+                value = empty
+        elif f == 'minOrder' and value is None:
+            value = 1
+        elif f in ('verified', 'views') and value is None:
+            value = 0
+        elif f == 'averageRating':
+            value = round(value, 1) if value else 0
+        ad[f] = value
+    if image_width and ad.get('imageUrl'):
+        variants = json.loads(row['imageVariants']) if row['imageVariants'] else None
+        ad['imageUrl'] = pick_image_variant(ad['imageUrl'], variants, image_width)
+    return ad
+
+
+def query_ads(cur, fields, where='', params=(), limit=None):
+    """Select ads newest first, projected to `fields`.
+
+    The page of ads is chosen first and the owner join only runs over that
+    page; review stats are stored on the ad row itself.
+    """
+    select_fields = fields + ['createdAt']
+    if 'imageUrl' in fields:
+        select_fields.append('imageVariants')
+    select_fields = list(dict.fromkeys(select_fields))
+    columns = ', '.join(f'{AD_FIELDS[f]} AS {f}' for f in select_fields)
+    joins = ''
+    if AD_USER_FIELDS.intersection(fields):
+        joins += ' LEFT JOIN users u ON p.userId = u.id'
+    limit_sql = ''
+    if limit is not None:
+        limit_sql = 'LIMIT ?'
+        params = tuple(params) + (limit,)
+    cur.execute(f'''
+        WITH page AS (
+            SELECT * FROM ads {where}
+            ORDER BY createdAt DESC, id DESC
+            {limit_sql}
+        )
+        SELECT {columns}
+        FROM page p{joins}
+        ORDER BY p.createdAt DESC, p.id DESC
+    ''', params)
+    return cur.fetchall()
+
+
+# Listing kinds the home page shows; same rules the frontend used to apply
+# in the browser (ads by unknown-role users count as requirements when
+# they have no price)
+AD_TYPE_FILTERS = {
+    'product': '''price > 0 AND EXISTS (
+        SELECT 1 FROM users WHERE users.id = ads.userId AND users.role = 'seller')''',
+    'requirement': '''(EXISTS (
+        SELECT 1 FROM users WHERE users.id = ads.userId AND users.role = 'buyer')
+        OR (NOT EXISTS (
+            SELECT 1 FROM users WHERE users.id = ads.userId AND users.role IS NOT NULL)
+            AND (price IS NULL OR price = 0)))''',
+}
+
+
 @app.route('/api/ads', methods=['GET'])
-def get_ads():
+@conditional_on(ad_resources)
+@cached_response(ad_list_tags)
+def get_ads(user_id=None):
+    """List ads, newest first.
+
+    Optional query params:
+      limit  - page size (max MAX_PAGE_SIZE); without it every ad is returned
+      cursor - value of the X-Next-Cursor header from the previous page
+      fields - comma separated subset of AD_FIELDS to return
+      imageWidth - display width in px; imageUrl becomes the closest
+               thumbnail variant when one has been rendered
+      userId - only ads posted by this user
+      ids    - comma separated ad ids to fetch in one batch, returned in the
+               order given (limit and cursor are ignored)
+      type   - 'product' for priced seller listings, 'requirement' for
+               buyer posts (see AD_TYPE_FILTERS)
+    """
+    try:
+        fields = parse_ad_fields(request.args.get('fields'))
+        image_width = parse_image_width(request.args.get('imageWidth'))
+        limit = parse_limit(request.args.get('limit'))
+        clauses = []
+        params = []
+        if user_id is None and request.args.get('userId'):
+            try:
+                user_id = int(request.args['userId'])
+            except ValueError:
+                raise ValueError('userId must be an integer')
+        if user_id is not None:
+            clauses.append('userId = ?')
+            params.append(user_id)
+        ad_type = request.args.get('type')
+        if ad_type:
+            if ad_type not in AD_TYPE_FILTERS:
+                raise ValueError(f"type must be one of: {', '.join(AD_TYPE_FILTERS)}")
+            clauses.append(AD_TYPE_FILTERS[ad_type])
+        cursor = request.args.get('cursor')
+        ids = request.args.get('ids')
+        if ids is not None:
+            ids = parse_id_list(ids)
+            if not ids:
+                return jsonify([])
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+            limit = None
+        elif cursor:
+            created_at, last_id = decode_cursor(cursor, 2)
+            clauses.append('(createdAt, id) < (?, ?)')
+            params.extend((created_at, last_id))
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
-        import json
         db = get_db()
         cur = db.cursor()
-        cur.execute('SELECT ads.*, users.name AS author, users.storeName, users.role, users.profilePicture FROM ads LEFT JOIN users ON ads.userId = users.id ORDER BY createdAt DESC')
-        rows = cur.fetchall()
-        
+        rows = query_ads(cur, fields, where, params, limit)
+        db.close()
+
+        results = [serialize_ad(r, fields, image_width) for r in rows]
+        if ids:
+            position = {ad_id: i for i, ad_id in enumerate(ids)}
+            results.sort(key=lambda ad: position[ad['id']])
+        response = jsonify(results)
+        if limit is not None and len(rows) == limit:
+            last = rows[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last['createdAt'], last['id'])
+        return response
+    except Exception as e:
+        print('get_ads error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+
+@app.route('/api/users/<int:user_id>/ads', methods=['GET'])
+def get_user_ads(user_id):
+    """List one user's ads; takes the same query params as GET /api/ads"""
+    return get_ads(user_id)
+
+
+@app.route('/api/ads/<int:ad_id>', methods=['GET'])
+@conditional_on(ad_resources)
+@cached_response(lambda args, ad: {f'ad:{args["ad_id"]}', f'views:{args["ad_id"]}'})
+def get_ad(ad_id):
+    """Get a single ad with its seller and review stats (supports ?fields= and ?imageWidth=)"""
+    try:
+        fields = parse_ad_fields(request.args.get('fields'))
+        image_width = parse_image_width(request.args.get('imageWidth'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        db = get_db()
+        cur = db.cursor()
+        rows = query_ads(cur, fields, 'WHERE id = ?', (ad_id,))
+        db.close()
+
+        if not rows:
+            return jsonify({'error': 'Ad not found'}), 404
+        return jsonify(serialize_ad(rows[0], fields, image_width))
+    except Exception as e:
+        print('get_ad error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+
+# bm25() column weights for ads_fts: title, description, tags, storeName
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+SEARCH_DEFAULT_LIMIT = 20
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    words = [w.replace('"', '') for w in text.split()]
+    return ' '.join(f'"{w}"*' for w in words if w)
+
+
+@app.route('/api/search', methods=['GET'])
+def search_ads():
+    """Full-text search over ads, best match first.
+
+    Query params:
+      q        - search text; each word matches as a prefix of title,
+                 description, tags or the seller's store name
+      category - exact category; repeat for any of several
+      tag      - ads carrying this tag; repeat for any of several
+      author   - ads posted by a user of this name; repeat for any of several
+      minPrice, maxPrice - price range
+      verified - 1 for verified listings only
+      limit, cursor, fields, imageWidth - as for GET /api/ads
+    """
+    if not SEARCH_ENABLED:
+        return jsonify({'error': 'search unavailable'}), 503
+
+    try:
+        match = build_match_query(request.args.get('q', ''))
+        if not match:
+            return jsonify({'error': 'q required'}), 400
+        fields = parse_ad_fields(request.args.get('fields'))
+        image_width = parse_image_width(request.args.get('imageWidth'))
+        limit = parse_limit(request.args.get('limit'), SEARCH_DEFAULT_LIMIT)
+        clauses = []
+        params = [match]
+        filters = {
+            'category': 'ads.category IN ({})',
+            'tag': '''EXISTS (SELECT 1 FROM json_each(CASE WHEN json_valid(ads.tags)
+                       THEN ads.tags ELSE '[]' END) WHERE value IN ({}))''',
+            'author': 'ads.userId IN (SELECT id FROM users WHERE name IN ({}))',
+        }
+        for arg, clause in filters.items():
+            values = [v for v in request.args.getlist(arg) if v]
+            if values:
+                clauses.append(clause.format(','.join('?' * len(values))))
+                params.extend(values)
+        for arg, op in (('minPrice', '>='), ('maxPrice', '<=')):
+            if request.args.get(arg):
+                try:
+                    params.append(float(request.args[arg]))
+                except ValueError:
+                    raise ValueError(f'{arg} must be a number')
+                clauses.append(f'ads.price {op} ?')
+        if request.args.get('verified') in ('1', 'true'):
+            clauses.append('ads.verified = 1')
+        cursor = request.args.get('cursor')
+        if cursor:
+            score, last_id = decode_cursor(cursor, 2)
+            clauses.append('(hits.score, hits.id) > (?, ?)')
+            params.extend((score, last_id))
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        db = get_db()
+        cur = db.cursor()
+        weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+        try:
+            cur.execute(f'''
+                WITH hits AS (
+                    SELECT rowid AS id, bm25(ads_fts, {weights}) AS score
+                    FROM ads_fts
+                    WHERE ads_fts MATCH ?
+                )
+                SELECT hits.id, hits.score
+                FROM hits
+                JOIN ads ON ads.id = hits.id
+                {where}
+                ORDER BY hits.score, hits.id
+                LIMIT ?
+            ''', params + [limit])
+        except sqlite3.OperationalError:
+            db.close()
+            return jsonify({'error': 'invalid search query'}), 400
+        hits = cur.fetchall()
+
         results = []
-        for r in rows:
-            row_keys = r.keys()
+        if hits:
+            ids = [h['id'] for h in hits]
+            rows = query_ads(cur, fields, f"WHERE id IN ({','.join('?' * len(ids))})", ids)
+            by_id = {r['id']: serialize_ad(r, fields, image_width) for r in rows}
+            results = [by_id[i] for i in ids if i in by_id]
+        db.close()
+
+        response = jsonify(results)
+        if len(hits) == limit:
+            last = hits[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last['score'], last['id'])
+        return response
+    except Exception as e:
+        print('search_ads error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+
+# ===== VIEW COUNTS =====
+# Buffered views are written every VIEWS_FLUSH_INTERVAL seconds, or as soon
+# as VIEWS_FLUSH_THRESHOLD of them are pending
+VIEWS_FLUSH_INTERVAL = float(os.environ.get('VIEWS_FLUSH_INTERVAL', 5))
+VIEWS_FLUSH_THRESHOLD = int(os.environ.get('VIEWS_FLUSH_THRESHOLD', 1000))
+
+
+class ViewCounter:
+    """Buffers ad views in memory and writes them in batches.
+
+    record() only bumps a counter under a lock, so page views never wait
+    on SQLite's writer lock. A background thread adds the pending counts to
+    ads.views and the per-day ad_views_daily rollup in one transaction. A
+    batch that fails to commit is merged back and retried, and whatever is
+    pending is flushed at exit, so views are counted at least once.
+    """
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def record(self, ad_id):
+        day = datetime.utcnow().strftime('%Y-%m-%d')
+        with self.lock:
+            self.pending[(ad_id, day)] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self.thread.start()
+            if sum(self.pending.values()) >= self.threshold:
+                self.wakeup.set()
+
+    def flush(self):
+        """Write pending views; returns how many were written"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, Counter()
+            if not batch:
+                return 0
+            db = connect_db()
             try:
-                tags_val = r['tags'] if 'tags' in row_keys else None
-                tags = json.loads(tags_val) if tags_val else []
-            except:
-                tags = []
+                cur = db.cursor()
+                cur.execute('BEGIN IMMEDIATE')
+                per_ad = Counter()
+                for (ad_id, day), views in batch.items():
+                    per_ad[ad_id] += views
+                cur.executemany('UPDATE ads SET views = COALESCE(views, 0) + ? WHERE id = ?',
+                                [(views, ad_id) for ad_id, views in per_ad.items()])
+                cur.executemany('''
+                    INSERT INTO ad_views_daily (adId, day, views)
+                    SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM ads WHERE id = ?)
+                    ON CONFLICT(adId, day) DO UPDATE SET views = views + excluded.views
+                ''', [(ad_id, day, views, ad_id) for (ad_id, day), views in batch.items()])
+                db.commit()
+                # Lists that show views are keyed by the ad_views ETag; single ads are not
+                invalidate_cache(*(f'views:{ad_id}' for ad_id in per_ad))
+                return sum(batch.values())
+            except sqlite3.Error:
+                db.rollback()
+                with self.lock:
+                    self.pending.update(batch)
+                raise
+            finally:
+                db.close()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
             try:
-                category = r['category'] if 'category' in row_keys else None
-            except:
-                category = None
-            
-            # Get review stats for this product
-            ad_id = r['id']
-            cur.execute('''
-                SELECT 
-                    COUNT(*) as totalReviews,
-                    AVG(rating) as averageRating
-                FROM reviews
-                WHERE adId = ?
-            ''', (ad_id,))
-            review_row = cur.fetchone()
-            total_reviews = review_row[0] if review_row else 0
-            avg_rating = round(review_row[1], 1) if review_row and review_row[1] else 0
-            
-            # Safely get values with defaults
-            results.append({
-                'id': r['id'],
-                'title': r['title'],
-                'description': r['description'],
-                'userId': r['userId'],
-                'createdAt': r['createdAt'],
-                'author': r['author'] if 'author' in row_keys else None,
-                'storeName': r['storeName'] if 'storeName' in row_keys else None,
-                'role': r['role'] if 'role' in row_keys else None,
-                'profilePicture': r['profilePicture'] if 'profilePicture' in row_keys else None,
-                'category': category,
-                'tags': tags,
-                'price': r['price'] if 'price' in row_keys and r['price'] is not None else None,
-                'unit': r['unit'] if 'unit' in row_keys else None,
-                'minOrder': r['minOrder'] if 'minOrder' in row_keys and r['minOrder'] is not None else 1,
-                'stock': r['stock'] if 'stock' in row_keys else None,
-                'imageUrl': r['imageUrl'] if 'imageUrl' in row_keys else None,
-                'images': r['images'] if 'images' in row_keys else None,
-                'verified': r['verified'] if 'verified' in row_keys and r['verified'] is not None else 0,
-                'views': r['views'] if 'views' in row_keys and r['views'] is not None else 0,
-                'reviewCount': total_reviews,
-                'averageRating': avg_rating
-            })
-        
+                self.flush()
+            except sqlite3.Error as e:
+                print('view counter error:', e)
+
+
+view_counter = ViewCounter(VIEWS_FLUSH_INTERVAL, VIEWS_FLUSH_THRESHOLD)
+atexit.register(view_counter.flush)
+
+
+@app.route('/api/ads/<int:ad_id>/view', methods=['POST'])
+def record_ad_view(ad_id):
+    """Count a view of an ad; it is written to the database within a few seconds"""
+    view_counter.record(ad_id)
+    return jsonify({'success': True}), 202
+
+
+@app.route('/api/ads/<int:ad_id>/views', methods=['GET'])
+def get_ad_views(ad_id):
+    """Daily view counts for an ad over the last ?days= days (default 30)"""
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+    days = max(1, min(days, 366))
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute('SELECT views FROM ads WHERE id = ?', (ad_id,))
+        row = cursor.fetchone()
+        if not row:
+            db.close()
+            return jsonify({'error': 'Ad not found'}), 404
+        cursor.execute('''
+            SELECT day, views FROM ad_views_daily
+            WHERE adId = ? AND day > date('now', ?)
+            ORDER BY day
+        ''', (ad_id, f'-{days} days'))
+        daily = [{'day': r['day'], 'views': r['views']} for r in cursor.fetchall()]
         db.close()
-        return jsonify(results)
+        return jsonify({'adId': ad_id, 'totalViews': row['views'] or 0, 'daily': daily})
     except Exception as e:
-        print('get_ads error:', e)
+        print('get_ad_views error:', e)
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'database error'}), 500
@@ -497,8 +2210,11 @@ def post_ad():
         cur.execute('''INSERT INTO ads (title, description, userId, category, tags, price, unit, minOrder, stock, imageUrl, images) 
                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
                     (title, description, userId, category, tags_json, price, unit, minOrder, stock, imageUrl, images))
-        db.commit()
         last = cur.lastrowid
+        if imageUrl or images:
+            refresh_image_variants(cur, 'WHERE id = ?', (last,))
+        db.commit()
+        invalidate_cache('ads', f'ads:user:{userId}', f'ad:{last}', f'store:{userId}')
         cur.execute('SELECT ads.*, users.name AS author, users.role FROM ads LEFT JOIN users ON ads.userId = users.id WHERE ads.id = ?', (last,))
         row = cur.fetchone()
         db.close()
@@ -577,9 +2293,13 @@ def update_ad(ad_id):
         cursor = db.cursor()
         query = f"UPDATE ads SET {', '.join(update_fields)} WHERE id = ?"
         cursor.execute(query, values)
+        updated = cursor.rowcount
+        if updated and ('imageUrl' in data or 'images' in data):
+            refresh_image_variants(cursor, 'WHERE id = ?', (ad_id,))
         db.commit()
+        invalidate_cache(f'ad:{ad_id}')
         
-        if cursor.rowcount == 0:
+        if updated == 0:
             db.close()
             return jsonify({'success': False, 'error': 'Ad not found'}), 404
         
@@ -597,10 +2317,13 @@ def delete_ad(ad_id):
     try:
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM ads WHERE id = ?', (ad_id,))
+        cursor.execute('SELECT userId FROM ads WHERE id = ?', (ad_id,))
+        owner = cursor.fetchone()
+        deleted = delete_ads(cursor, 'id = ?', (ad_id,))
         conn.commit()
+        invalidate_cache(f'ad:{ad_id}', f'reviews:{ad_id}', f'store:{owner[0] if owner else None}')
         
-        if cursor.rowcount == 0:
+        if deleted == 0:
             return jsonify({'success': False, 'error': 'Ad not found'}), 404
         
         return jsonify({'success': True})
@@ -630,14 +2353,10 @@ def update_profile():
         profile_picture = None
         pic_file = files.get('profilePicture') if files else None
         if pic_file and getattr(pic_file, 'filename', None):
-            uploads_dir = BASE_DIR / 'public' / 'uploads'
-            uploads_dir.mkdir(parents=True, exist_ok=True)
-            filename = secure_filename(pic_file.filename)
-            ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            filename = f"profile_{ts}_{filename}"
-            save_path = uploads_dir / filename
-            pic_file.save(str(save_path))
-            profile_picture = f"/uploads/{filename}"
+            try:
+                profile_picture = save_upload(pic_file)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # Build update query dynamically
         updates = []
@@ -675,6 +2394,7 @@ def update_profile():
         cursor = db.cursor()
         cursor.execute(query, params)
         db.commit()
+        invalidate_cache(*user_cache_tags(cursor, user_id))
         
         # Fetch updated user data
         cursor.execute('SELECT id, name, email, phone, role, storeName, businessType, categories, address, website, logo_path, uniqueId, location, profilePicture FROM users WHERE id = ?', (user_id,))
@@ -702,6 +2422,8 @@ def update_profile():
             'profilePicture': row['profilePicture']
         }
         return jsonify(user_data)
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         print('update_profile error:', e)
         import traceback
@@ -709,13 +2431,225 @@ def update_profile():
         return jsonify({'error': 'database error'}), 500
 
 
+# ===== CASCADE DELETES =====
+# A deleted user's messages are removed in the same transaction up to this
+# many; past it the conversations go at once and their messages are purged
+# in the background in batches, so one large account doesn't hold SQLite's
+# writer lock for seconds
+PURGE_INLINE_MESSAGES = int(os.environ.get('PURGE_INLINE_MESSAGES', 5000))
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+# Seconds between purge batches, leaving the writer lock to requests
+PURGE_PAUSE = float(os.environ.get('PURGE_PAUSE', 0.05))
+
+# Statements removing what hangs off the ads selected by {ads}, ads last
+AD_CASCADE = [
+    'DELETE FROM reviews WHERE adId IN ({ads})',
+    'DELETE FROM wishlist WHERE adId IN ({ads})',
+    'DELETE FROM ad_views_daily WHERE adId IN ({ads})',
+    # A conversation outlives the listing it started from
+    'UPDATE conversations SET listingId = NULL WHERE listingId IN ({ads})',
+    'DELETE FROM ads WHERE id IN ({ads})',
+]
+
+
+def missing(table, column):
+    """SQL that is true when row t points at a `table` row that no longer exists"""
+    return f't.{column} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.id = t.{column})'
+
+
+# Rows whose parent is gone, as (table, key, condition on row t). Parents
+# come before children so one pass also catches what a sweep orphans.
+ORPHAN_SWEEPS = [
+    ('ads', 'id', missing('users', 'userId')),
+    ('reviews', 'id', f"{missing('ads', 'adId')} OR {missing('users', 'userId')}"),
+    ('wishlist', 'id', f"{missing('ads', 'adId')} OR {missing('users', 'userId')}"),
+    ('ad_views_daily', 'adId', missing('ads', 'adId')),
+    ('conversations', 'id', f"{missing('users', 'buyerId')} OR {missing('users', 'sellerId')}"),
+    ('messages', 'id', missing('conversations', 'conversationId')),
+    ('unread_counts', 'userId', missing('users', 'userId')),
+]
+
+
+def delete_ads(cur, where, params=()):
+    """Delete the ads matching `where` with their reviews, wishlist rows and view rollups.
+
+    Runs in the caller's transaction; returns how many ads were deleted.
+    Review stats, wishlist counts, upload refcounts and the search index
+    follow through their triggers.
+    """
+    ads = f'SELECT id FROM ads WHERE {where}'
+    for sql in AD_CASCADE:
+        cur.execute(sql.format(ads=ads), params)
+    return cur.rowcount
+
+
+def delete_user(cur, user_id):
+    """Delete a user and everything that belongs to them, in the caller's transaction.
+
+    Returns (deleted, deferred): whether the user existed, and how many
+    of their messages were left for purge_orphans() because there were
+    more than PURGE_INLINE_MESSAGES. Those messages are unreachable once
+    their conversations are gone.
+    """
+    delete_ads(cur, 'userId = ?', (user_id,))
+    cur.execute('DELETE FROM reviews WHERE userId = ?', (user_id,))
+    cur.execute('DELETE FROM wishlist WHERE userId = ?', (user_id,))
+
+    conversations = 'SELECT id FROM conversations WHERE buyerId = :user OR sellerId = :user'
+    # The other side of each conversation stops counting its unread messages
+    cur.execute('''
+        UPDATE unread_counts SET unreadCount = MAX(unreadCount - c.unread, 0)
+        FROM (
+            SELECT CASE WHEN buyerId = :user THEN sellerId ELSE buyerId END AS userId,
+                   SUM(CASE WHEN buyerId = :user THEN sellerUnread ELSE buyerUnread END) AS unread
+            FROM conversations
+            WHERE (buyerId = :user OR sellerId = :user) AND buyerId != sellerId
+            GROUP BY 1
+        ) AS c
+        WHERE unread_counts.userId = c.userId
+    ''', {'user': user_id})
+    cur.execute(f'SELECT COUNT(*) FROM messages WHERE conversationId IN ({conversations})', {'user': user_id})
+    messages = cur.fetchone()[0]
+    deferred = messages if messages > PURGE_INLINE_MESSAGES else 0
+    if not deferred:
+        cur.execute(f'DELETE FROM messages WHERE conversationId IN ({conversations})', {'user': user_id})
+    cur.execute('DELETE FROM conversations WHERE buyerId = :user OR sellerId = :user', {'user': user_id})
+    cur.execute('DELETE FROM unread_counts WHERE userId = ?', (user_id,))
+
+    cur.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    return cur.rowcount > 0, deferred
+
+
+def purge_orphans(db, sweeps=ORPHAN_SWEEPS, batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE):
+    """Delete orphaned rows in batches, one short write transaction per batch.
+
+    Each table is walked once in key order, finding orphans outside any
+    transaction. Parents are never re-created under an old id (ids are
+    AUTOINCREMENT), so a row found orphaned stays orphaned. Returns the
+    number of rows deleted per table.
+    """
+    cur = db.cursor()
+    deleted = {}
+    for table, key, orphaned in sweeps:
+        deleted[table] = 0
+        last = None
+        while True:
+            after, params = ('', ()) if last is None else (f't.{key} > ? AND', (last,))
+            cur.execute(f'''
+                SELECT DISTINCT t.{key} FROM {table} t
+                WHERE {after} ({orphaned})
+                ORDER BY t.{key} LIMIT ?
+            ''', (*params, batch_size))
+            keys = [r[0] for r in cur.fetchall()]
+            if not keys:
+                break
+            cur.execute('BEGIN IMMEDIATE')
+            cur.execute(f"DELETE FROM {table} WHERE {key} IN ({','.join('?' * len(keys))})", keys)
+            deleted[table] += cur.rowcount
+            db.commit()
+            last = keys[-1]
+            if len(keys) < batch_size:
+                break
+            time.sleep(pause)
+    return deleted
+
+
+class OrphanPurger:
+    """Runs purge_orphans() for messages on a background thread when woken.
+
+    delete_user() leaves the messages of large accounts behind; wake()
+    after committing it starts (or re-runs) the purge. A purge interrupted
+    by a restart is finished by the next one or by `flask purge-orphans`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='orphan-purger', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def _run(self):
+        sweeps = [sweep for sweep in ORPHAN_SWEEPS if sweep[0] == 'messages']
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            db = connect_db()
+            try:
+                deleted = purge_orphans(db, sweeps)
+                print(f"purged {deleted['messages']} orphaned message(s)")
+            except sqlite3.Error as e:
+                print('orphan purger error:', e)
+            finally:
+                db.close()
+
+
+orphan_purger = OrphanPurger()
+
+
 # Admin endpoints
+ADMIN_USERS_DEFAULT_LIMIT = 50
+ADMIN_USER_SEARCH_COLUMNS = ('name', 'email', 'storeName', 'uniqueId')
+
+
+def escape_like(value):
+    """Escape LIKE wildcards so value matches literally (with ESCAPE '\\')"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
 @app.route('/api/admin/users', methods=['GET'])
 def admin_get_users():
+    """List users newest first with their listing counts.
+
+    Optional query params:
+      limit  - page size (default 50, max MAX_PAGE_SIZE)
+      cursor - nextCursor from the previous page
+      q      - substring of name, email, storeName or uniqueId
+      role   - buyer or seller (users without a role count as buyers)
+    Responds with {success, users, nextCursor}.
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'), ADMIN_USERS_DEFAULT_LIMIT)
+        clauses = []
+        params = []
+        if request.args.get('role'):
+            clauses.append("COALESCE(role, 'buyer') = ?")
+            params.append(request.args['role'])
+        q = request.args.get('q', '').strip()
+        if q:
+            pattern = f'%{escape_like(q)}%'
+            clauses.append('(' + ' OR '.join(f"{c} LIKE ? ESCAPE '\\'" for c in ADMIN_USER_SEARCH_COLUMNS) + ')')
+            params.extend([pattern] * len(ADMIN_USER_SEARCH_COLUMNS))
+        if request.args.get('cursor'):
+            (last_id,) = decode_cursor(request.args['cursor'], 1)
+            clauses.append('id < ?')
+            params.append(last_id)
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         db = get_db()
         cursor = db.cursor()
-        cursor.execute('SELECT id, name, email, phone, role, storeName, businessType, categories, address, website, logo_path, uniqueId, location, profilePicture, createdAt FROM users ORDER BY createdAt DESC')
+        # The page is chosen first so only its users' ads are counted
+        cursor.execute(f'''
+            WITH page AS (
+                SELECT id, name, email, phone, role, storeName, businessType, categories, address, website,
+                       logo_path, uniqueId, location, profilePicture, createdAt
+                FROM users {where}
+                ORDER BY id DESC
+                LIMIT ?
+            )
+            SELECT page.*, COUNT(a.id) AS listingCount
+            FROM page LEFT JOIN ads a ON a.userId = page.id
+            GROUP BY page.id
+            ORDER BY page.id DESC
+        ''', (*params, limit))
         rows = cursor.fetchall()
         db.close()
         
@@ -736,10 +2670,12 @@ def admin_get_users():
                 'uniqueId': row['uniqueId'],
                 'location': row['location'],
                 'profilePicture': row['profilePicture'],
-                'createdAt': row['createdAt']
+                'createdAt': row['createdAt'],
+                'listingCount': row['listingCount']
             })
         
-        return jsonify({'success': True, 'users': users})
+        next_cursor = encode_cursor(rows[-1]['id']) if len(rows) == limit else None
+        return jsonify({'success': True, 'users': users, 'nextCursor': next_cursor})
     except Exception as e:
         print('admin_get_users error:', e)
         import traceback
@@ -747,6 +2683,30 @@ def admin_get_users():
         return jsonify({'error': 'database error'}), 500
 
 
+@app.route('/api/admin/stats', methods=['GET'])
+def admin_get_stats():
+    """Count users by role and listings for the admin dashboard"""
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) AS users,
+                   COALESCE(SUM(role = 'seller'), 0) AS sellers,
+                   COALESCE(SUM(COALESCE(role, 'buyer') = 'buyer'), 0) AS buyers,
+                   (SELECT COUNT(*) FROM ads) AS ads
+            FROM users
+        ''')
+        row = cursor.fetchone()
+        db.close()
+        return jsonify({'success': True, 'users': row['users'], 'sellers': row['sellers'],
+                        'buyers': row['buyers'], 'ads': row['ads']})
+    except Exception as e:
+        print('admin_get_stats error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+
 @app.route('/api/admin/users/<int:user_id>', methods=['PUT'])
 def admin_update_user(user_id):
     try:
@@ -788,6 +2748,7 @@ def admin_update_user(user_id):
         cursor = db.cursor()
         cursor.execute(query, params)
         db.commit()
+        invalidate_cache(*user_cache_tags(cursor, user_id))
         db.close()
         
         return jsonify({'success': True})
@@ -807,7 +2768,7 @@ def admin_reset_password(user_id):
         if not password:
             return jsonify({'error': 'password required'}), 400
         
-        hashed = generate_password_hash(password)
+        hashed = hash_password(password)
         
         db = get_db()
         cursor = db.cursor()
@@ -816,6 +2777,8 @@ def admin_reset_password(user_id):
         db.close()
         
         return jsonify({'success': True})
+    except ServiceUnavailable:
+        raise
     except Exception as e:
         print('admin_reset_password error:', e)
         import traceback
@@ -829,14 +2792,19 @@ def admin_delete_user(user_id):
         db = get_db()
         cursor = db.cursor()
         
-        # Delete user's ads first
-        cursor.execute('DELETE FROM ads WHERE userId = ?', (user_id,))
+        cache_tags = user_cache_tags(cursor, user_id)
+        # Ads whose review stats or wishlist count the deletion changes
+        cursor.execute('SELECT adId FROM reviews WHERE userId = ? UNION SELECT adId FROM wishlist WHERE userId = ?',
+                       (user_id, user_id))
+        cache_tags.extend(f'ad:{r[0]}' for r in cursor.fetchall())
         
-        # Delete user
-        cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        deleted, deferred = delete_user(cursor, user_id)
         db.commit()
+        invalidate_cache('stores', *cache_tags)
+        if deferred:
+            orphan_purger.wake()
         
-        if cursor.rowcount == 0:
+        if not deleted:
             db.close()
             return jsonify({'success': False, 'error': 'User not found'}), 404
         
@@ -849,6 +2817,171 @@ def admin_delete_user(user_id):
         return jsonify({'error': 'database error'}), 500
 
 
+# ===== LIVE EVENTS =====
+# Seconds between polls of the events table by each process's hub thread
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+# How long delivered events are kept for reconnecting streams to replay
+EVENTS_RETENTION_SECONDS = int(os.environ.get('EVENTS_RETENTION_SECONDS', 600))
+# Open streams allowed per process. Each one holds a worker thread, so keep
+# this well under gunicorn's --threads; past it clients get 503 and poll
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 8))
+EVENTS_KEEPALIVE_SECONDS = 15
+
+
+def publish_event(cursor, user_ids, event_type, data):
+    """Queue an event for users; it is delivered once the caller's transaction commits"""
+    payload = json.dumps(data)
+    cursor.executemany('INSERT INTO events (userId, type, data) VALUES (?, ?, ?)',
+                       [(user_id, event_type, payload) for user_id in set(user_ids)])
+
+
+class EventHub:
+    """Fans events out to the SSE streams open in this process.
+
+    The events table acts as the broker: whichever worker handles a write
+    appends to it, and every worker process runs one hub thread that tails
+    it. One indexed query per poll serves all of a process's streams, and
+    wake() lets a writer in the same process skip the poll delay.
+    """
+
+    def __init__(self, poll_interval, max_streams):
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self.streams = 0
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def subscribe(self, user_id):
+        """Return a queue of the user's events, or None when this process is at max_streams"""
+        q = queue.Queue(maxsize=1000)
+        with self.lock:
+            if self.streams >= self.max_streams:
+                return None
+            self.streams += 1
+            self.subscribers.setdefault(user_id, set()).add(q)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self.lock:
+            queues = self.subscribers.get(user_id)
+            if queues and q in queues:
+                self.streams -= 1
+                queues.discard(q)
+                if not queues:
+                    del self.subscribers[user_id]
+
+    def wake(self):
+        self.wakeup.set()
+
+    def _deliver(self, row):
+        with self.lock:
+            queues = list(self.subscribers.get(row['userId'], ()))
+        for q in queues:
+            try:
+                q.put_nowait((row['id'], row['type'], row['data']))
+            except queue.Full:
+                # A stalled client; it can catch up by reconnecting with Last-Event-ID
+                pass
+
+    def _run(self):
+        db = connect_db()
+        last_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        pruned_at = 0
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                rows = db.execute('SELECT id, userId, type, data FROM events WHERE id > ? ORDER BY id',
+                                  (last_id,)).fetchall()
+                for row in rows:
+                    last_id = row['id']
+                    self._deliver(row)
+                if time.monotonic() - pruned_at > 60:
+                    pruned_at = time.monotonic()
+                    db.execute("DELETE FROM events WHERE createdAt < datetime('now', ?)",
+                               (f'-{EVENTS_RETENTION_SECONDS} seconds',))
+                    db.commit()
+            except sqlite3.Error as e:
+                print('event hub error:', e)
+
+
+event_hub = EventHub(EVENTS_POLL_INTERVAL, EVENTS_MAX_STREAMS)
+
+
+def format_sse(event_type, data, event_id=None):
+    """Format one Server-Sent Events frame; data is a JSON string"""
+    frame = f'event: {event_type}\ndata: {data}\n\n'
+    if event_id is not None:
+        frame = f'id: {event_id}\n' + frame
+    return frame
+
+
+@app.route('/api/events/<int:user_id>', methods=['GET'])
+def stream_events(user_id):
+    """Server-Sent Events stream of a user's new messages, read receipts and unread count.
+
+    Event types: "message" (to both participants), "read" (to the other
+    participant when messages are marked read) and "unread" (the user's new
+    total). A reconnecting EventSource sends Last-Event-ID and gets the
+    events it missed replayed first. Past EVENTS_MAX_STREAMS open streams
+    in this process it answers 503, and the client falls back to polling.
+    """
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        last_event_id = 0
+
+    q = event_hub.subscribe(user_id)
+    if q is None:
+        return jsonify({'error': 'too many open streams'}), 503
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        backlog = []
+        if last_event_id:
+            cursor.execute('SELECT id, type, data FROM events WHERE userId = ? AND id > ? ORDER BY id',
+                           (user_id, last_event_id))
+            backlog = cursor.fetchall()
+        unread = count_unread(cursor, user_id)
+        db.close()
+    except Exception as e:
+        event_hub.unsubscribe(user_id, q)
+        print('stream_events error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+    def generate():
+        sent = last_event_id
+        try:
+            yield 'retry: 3000\n\n'
+            for row in backlog:
+                sent = row['id']
+                yield format_sse(row['type'], row['data'], row['id'])
+            yield format_sse('unread', json.dumps({'unreadCount': unread}))
+            while True:
+                try:
+                    event_id, event_type, data = q.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                # Already sent as part of the replayed backlog
+                if event_id <= sent:
+                    continue
+                sent = event_id
+                yield format_sse(event_type, data, event_id)
+        finally:
+            event_hub.unsubscribe(user_id, q)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/conversations', methods=['POST'])
 def start_conversation():
     """Start a new conversation (buyer initiates with seller)"""
@@ -893,26 +3026,37 @@ def start_conversation():
 
 
 @app.route('/api/conversations/<int:user_id>', methods=['GET'])
+@conditional_on(lambda args: [f'conversations:{args["user_id"]}', 'users'])
 def get_user_conversations(user_id):
     """Get all conversations for a user"""
     try:
         db = get_db()
         cursor = db.cursor()
         
-        # Get conversations where user is buyer or seller
+        # Get conversations where user is buyer or seller. Last message and
+        # unread counts are kept on the conversation by send_message() and
+        # mark_messages_read(); each side is its own index range scan.
         cursor.execute('''
             SELECT 
                 c.id, c.buyerId, c.sellerId, c.listingId, c.createdAt,
                 buyer.name as buyerName, buyer.email as buyerEmail, buyer.profilePicture as buyerPicture,
                 seller.name as sellerName, seller.email as sellerEmail, seller.profilePicture as sellerPicture,
                 seller.storeName,
-                (SELECT message FROM messages WHERE conversationId = c.id ORDER BY createdAt DESC LIMIT 1) as lastMessage,
-                (SELECT createdAt FROM messages WHERE conversationId = c.id ORDER BY createdAt DESC LIMIT 1) as lastMessageTime,
-                (SELECT COUNT(*) FROM messages WHERE conversationId = c.id AND senderId != ? AND isRead = 0) as unreadCount
-            FROM conversations c
+                lm.message as lastMessage,
+                c.lastMessageAt as lastMessageTime,
+                c.unreadCount
+            FROM (
+                SELECT id, buyerId, sellerId, listingId, createdAt, lastMessageId, lastMessageAt,
+                       buyerUnread AS unreadCount
+                FROM conversations WHERE buyerId = ?
+                UNION ALL
+                SELECT id, buyerId, sellerId, listingId, createdAt, lastMessageId, lastMessageAt,
+                       sellerUnread AS unreadCount
+                FROM conversations WHERE sellerId = ? AND buyerId != ?
+            ) c
             JOIN users buyer ON c.buyerId = buyer.id
             JOIN users seller ON c.sellerId = seller.id
-            WHERE c.buyerId = ? OR c.sellerId = ?
+            LEFT JOIN messages lm ON lm.id = c.lastMessageId
             ORDER BY lastMessageTime DESC, c.createdAt DESC
         ''', (user_id, user_id, user_id))
         
@@ -948,22 +3092,65 @@ def get_user_conversations(user_id):
 
 @app.route('/api/messages/<int:conversation_id>', methods=['GET'])
 def get_messages(conversation_id):
-    """Get all messages in a conversation"""
+    """Get messages in a conversation, oldest first.
+
+    Optional query params:
+      after_id  - only messages newer than this id (what a client is missing)
+      before_id - the page of messages just older than this id (history)
+      limit     - page size (max MAX_PAGE_SIZE); with neither cursor it
+                  returns the latest messages. Without any params the whole
+                  conversation is returned.
+    """
+    try:
+        after_id = before_id = None
+        if request.args.get('after_id'):
+            after_id = int(request.args['after_id'])
+        if request.args.get('before_id'):
+            before_id = int(request.args['before_id'])
+    except ValueError:
+        return jsonify({'error': 'after_id and before_id must be integers'}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         db = get_db()
         cursor = db.cursor()
         
-        cursor.execute('''
+        condition = ''
+        params = [conversation_id]
+        newest_first = False
+        if after_id is not None:
+            condition = 'AND m.id > ?'
+            params.append(after_id)
+            limit = limit or MAX_PAGE_SIZE
+        elif before_id is not None:
+            condition = 'AND m.id < ?'
+            params.append(before_id)
+            limit = limit or MAX_PAGE_SIZE
+            newest_first = True
+        elif limit is not None:
+            newest_first = True
+        limit_sql = ''
+        if limit is not None:
+            limit_sql = 'LIMIT ?'
+            params.append(limit)
+
+        cursor.execute(f'''
             SELECT 
                 m.id, m.conversationId, m.senderId, m.message, m.createdAt,
                 u.name as senderName, u.email as senderEmail, u.profilePicture
             FROM messages m
             JOIN users u ON m.senderId = u.id
-            WHERE m.conversationId = ?
-            ORDER BY m.createdAt ASC
-        ''', (conversation_id,))
+            WHERE m.conversationId = ? {condition}
+            ORDER BY m.id {'DESC' if newest_first else 'ASC'}
+            {limit_sql}
+        ''', params)
         
         rows = cursor.fetchall()
+        if newest_first:
+            rows.reverse()
         messages = []
         for r in rows:
             messages.append({
@@ -1016,9 +3203,35 @@ def send_message():
             INSERT INTO messages (conversationId, senderId, message, isRead)
             VALUES (?, ?, ?, 0)
         ''', (conversation_id, sender_id, message))
-        db.commit()
         message_id = cursor.lastrowid
+        cursor.execute('SELECT createdAt FROM messages WHERE id = ?', (message_id,))
+        created_at = cursor.fetchone()[0]
+
+        # Keep the inbox summary on the conversation current
+        recipient_id = conv[1] if sender_id == conv[0] else conv[0]
+        unread_column = 'buyerUnread' if recipient_id == conv[0] else 'sellerUnread'
+        cursor.execute(f'''
+            UPDATE conversations
+            SET lastMessageId = ?, lastMessageAt = ?, {unread_column} = {unread_column} + 1
+            WHERE id = ?
+        ''', (message_id, created_at, conversation_id))
+        cursor.execute('''
+            INSERT INTO unread_counts (userId, unreadCount) VALUES (?, 1)
+            ON CONFLICT(userId) DO UPDATE SET unreadCount = unreadCount + 1
+        ''', (recipient_id,))
+
+        # Push to both participants' open streams
+        publish_event(cursor, [sender_id, recipient_id], 'message', {
+            'id': message_id,
+            'conversationId': conversation_id,
+            'senderId': sender_id,
+            'message': message,
+            'createdAt': created_at
+        })
+        publish_event(cursor, [recipient_id], 'unread', {'unreadCount': count_unread(cursor, recipient_id)})
+        db.commit()
         db.close()
+        event_hub.wake()
         
         return jsonify({'success': True, 'messageId': message_id})
     except Exception as e:
@@ -1028,23 +3241,24 @@ def send_message():
         return jsonify({'error': 'database error'}), 500
 
 
+def count_unread(cursor, user_id):
+    """Count unread messages where user is the recipient (not the sender).
+
+    Read from unread_counts, which send_message() and mark_messages_read()
+    keep current; `flask reconcile-unread-counts` rebuilds it from messages.
+    """
+    cursor.execute('SELECT unreadCount FROM unread_counts WHERE userId = ?', (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
 @app.route('/api/messages/unread/<int:user_id>', methods=['GET'])
 def get_unread_count(user_id):
     """Get count of unread messages for a user"""
     try:
         db = get_db()
         cursor = db.cursor()
-        
-        # Count unread messages where user is the recipient (not the sender)
-        cursor.execute('''
-            SELECT COUNT(*) FROM messages m
-            JOIN conversations c ON m.conversationId = c.id
-            WHERE m.isRead = 0 
-            AND m.senderId != ?
-            AND (c.buyerId = ? OR c.sellerId = ?)
-        ''', (user_id, user_id, user_id))
-        
-        count = cursor.fetchone()[0]
+        count = count_unread(cursor, user_id)
         db.close()
         
         return jsonify({'unreadCount': count})
@@ -1068,6 +3282,13 @@ def mark_messages_read(conversation_id):
         db = get_db()
         cursor = db.cursor()
         
+        # Only a participant's read changes the messages and their counters
+        cursor.execute('SELECT buyerId, sellerId FROM conversations WHERE id = ?', (conversation_id,))
+        conv = cursor.fetchone()
+        if not conv or (user_id != conv[0] and user_id != conv[1]):
+            db.close()
+            return jsonify({'error': 'Unauthorized'}), 403
+        
         # Mark messages as read where user is the recipient
         cursor.execute('''
             UPDATE messages 
@@ -1077,8 +3298,21 @@ def mark_messages_read(conversation_id):
             AND isRead = 0
         ''', (conversation_id, user_id))
         
+        # Only an actual change is pushed, so re-reading an open chat is silent
+        marked = cursor.rowcount
+        if marked > 0:
+            cursor.execute('''
+                UPDATE unread_counts SET unreadCount = MAX(unreadCount - ?, 0) WHERE userId = ?
+            ''', (marked, user_id))
+            unread_column = 'buyerUnread' if user_id == conv[0] else 'sellerUnread'
+            cursor.execute(f'UPDATE conversations SET {unread_column} = 0 WHERE id = ?', (conversation_id,))
+            other_id = conv[1] if user_id == conv[0] else conv[0]
+            publish_event(cursor, [other_id], 'read', {'conversationId': conversation_id, 'readerId': user_id})
+            publish_event(cursor, [user_id], 'unread', {'unreadCount': count_unread(cursor, user_id)})
+        
         db.commit()
         db.close()
+        event_hub.wake()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1088,62 +3322,68 @@ def mark_messages_read(conversation_id):
         return jsonify({'error': 'database error'}), 500
 
 
+# Ad fields a wishlist page returns unless ?fields= asks for others
+WISHLIST_AD_FIELDS = ['id', 'title', 'description', 'userId', 'createdAt', 'author', 'storeName', 'role',
+                      'profilePicture', 'category', 'tags', 'price', 'unit', 'minOrder', 'stock', 'imageUrl']
+
+
 @app.route('/api/wishlist/<int:user_id>', methods=['GET'])
 def get_wishlist(user_id):
-    """Get all wishlist items for a user"""
+    """List a user's wishlist, most recently saved first.
+
+    Each item is the ad (projected like GET /api/ads) plus wishlistId and
+    addedAt. Optional query params:
+      limit      - page size (max MAX_PAGE_SIZE); without it the whole wishlist
+                   is returned, as older clients expect
+      cursor     - value of the X-Next-Cursor header from the previous page
+      fields     - comma separated subset of AD_FIELDS to return
+      imageWidth - display width in px for the imageUrl thumbnail
+    """
+    try:
+        fields = parse_ad_fields(request.args.get('fields')) if request.args.get('fields') else WISHLIST_AD_FIELDS
+        image_width = parse_image_width(request.args.get('imageWidth'))
+        limit = parse_limit(request.args.get('limit'))
+        where = 'w.userId = ?'
+        params = [user_id]
+        if request.args.get('cursor'):
+            added_at, last_id = decode_cursor(request.args['cursor'], 2)
+            where += ' AND (w.createdAt, w.id) < (?, ?)'
+            params.extend((added_at, last_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         db = get_db()
         cursor = db.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                w.id as wishlistId, w.createdAt as addedAt,
-                ads.*, 
-                users.name AS author, 
-                users.storeName, 
-                users.role, 
-                users.profilePicture
+        select_fields = fields + ['imageVariants'] if 'imageUrl' in fields else fields
+        columns = ', '.join(f'{AD_FIELDS[f]} AS {f}' for f in dict.fromkeys(select_fields))
+        joins = ' LEFT JOIN users u ON p.userId = u.id' if AD_USER_FIELDS.intersection(fields) else ''
+        limit_sql = ''
+        if limit is not None:
+            limit_sql = 'LIMIT ?'
+            params.append(limit)
+        # idx_wishlist_user (userId, createdAt, rowid) walks the page in order
+        cursor.execute(f'''
+            SELECT w.id AS wishlistId, w.createdAt AS addedAt, {columns}
             FROM wishlist w
-            JOIN ads ON w.adId = ads.id
-            LEFT JOIN users ON ads.userId = users.id
-            WHERE w.userId = ?
-            ORDER BY w.createdAt DESC
-        ''', (user_id,))
-        
+            JOIN ads p ON p.id = w.adId{joins}
+            WHERE {where}
+            ORDER BY w.createdAt DESC, w.id DESC
+            {limit_sql}
+        ''', params)
         rows = cursor.fetchall()
+        db.close()
+
         results = []
         for r in rows:
-            import json
-            row_keys = r.keys()
-            try:
-                tags_val = r['tags'] if 'tags' in row_keys else None
-                tags = json.loads(tags_val) if tags_val else []
-            except:
-                tags = []
-            
-            results.append({
-                'wishlistId': r['wishlistId'],
-                'addedAt': r['addedAt'],
-                'id': r['id'],
-                'title': r['title'],
-                'description': r['description'],
-                'userId': r['userId'],
-                'createdAt': r['createdAt'],
-                'author': r['author'] if 'author' in row_keys else None,
-                'storeName': r['storeName'] if 'storeName' in row_keys else None,
-                'role': r['role'] if 'role' in row_keys else None,
-                'profilePicture': r['profilePicture'] if 'profilePicture' in row_keys else None,
-                'category': r['category'] if 'category' in row_keys else None,
-                'tags': tags,
-                'price': r['price'] if 'price' in row_keys and r['price'] is not None else None,
-                'unit': r['unit'] if 'unit' in row_keys else None,
-                'minOrder': r['minOrder'] if 'minOrder' in row_keys and r['minOrder'] is not None else 1,
-                'stock': r['stock'] if 'stock' in row_keys else None,
-                'imageUrl': r['imageUrl'] if 'imageUrl' in row_keys else None
-            })
-        
-        db.close()
-        return jsonify(results)
+            item = {'wishlistId': r['wishlistId'], 'addedAt': r['addedAt']}
+            item.update(serialize_ad(r, fields, image_width))
+            results.append(item)
+        response = jsonify(results)
+        if limit is not None and len(rows) == limit:
+            last = rows[-1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last['addedAt'], last['wishlistId'])
+        return response
     except Exception as e:
         print('get_wishlist error:', e)
         import traceback
@@ -1165,19 +3405,15 @@ def add_to_wishlist():
         db = get_db()
         cursor = db.cursor()
         
-        # Check if already in wishlist
-        cursor.execute('SELECT id FROM wishlist WHERE userId = ? AND adId = ?', (user_id, ad_id))
-        existing = cursor.fetchone()
-        
-        if existing:
+        # UNIQUE(userId, adId) turns a repeated add into a no-op
+        cursor.execute('INSERT OR IGNORE INTO wishlist (userId, adId) VALUES (?, ?)', (user_id, ad_id))
+        db.commit()
+        if cursor.rowcount == 0:
             db.close()
             return jsonify({'success': True, 'message': 'Already in wishlist'})
-        
-        # Add to wishlist
-        cursor.execute('INSERT INTO wishlist (userId, adId) VALUES (?, ?)', (user_id, ad_id))
-        db.commit()
         wishlist_id = cursor.lastrowid
         db.close()
+        invalidate_cache(f'ad:{ad_id}')
         
         return jsonify({'success': True, 'wishlistId': wishlist_id})
     except Exception as e:
@@ -1193,6 +3429,8 @@ def remove_from_wishlist(wishlist_id):
     try:
         db = get_db()
         cursor = db.cursor()
+        cursor.execute('SELECT adId FROM wishlist WHERE id = ?', (wishlist_id,))
+        row = cursor.fetchone()
         cursor.execute('DELETE FROM wishlist WHERE id = ?', (wishlist_id,))
         db.commit()
         
@@ -1201,6 +3439,7 @@ def remove_from_wishlist(wishlist_id):
             return jsonify({'success': False, 'error': 'Item not found'}), 404
         
         db.close()
+        invalidate_cache(f'ad:{row[0]}')
         return jsonify({'success': True})
     except Exception as e:
         print('remove_from_wishlist error:', e)
@@ -1234,8 +3473,41 @@ def check_wishlist():
         return jsonify({'error': 'database error'}), 500
 
 
+@app.route('/api/wishlist/<int:user_id>/ids', methods=['GET'])
+def get_wishlist_ids(user_id):
+    """Get which ads a user has wishlisted, e.g. to draw the hearts on a grid.
+
+    With ?adIds=1,2,3 only those ads are checked; otherwise every
+    wishlisted ad id is returned. Served from the UNIQUE(userId, adId) index.
+    """
+    try:
+        ad_ids = parse_id_list(request.args['adIds']) if request.args.get('adIds') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        if ad_ids is None:
+            cursor.execute('SELECT adId FROM wishlist WHERE userId = ?', (user_id,))
+        else:
+            placeholders = ','.join('?' * len(ad_ids))
+            cursor.execute(f'SELECT adId FROM wishlist WHERE userId = ? AND adId IN ({placeholders})',
+                           (user_id, *ad_ids))
+        wishlisted = [r[0] for r in cursor.fetchall()]
+        db.close()
+        return jsonify(wishlisted)
+    except Exception as e:
+        print('get_wishlist_ids error:', e)
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': 'database error'}), 500
+
+
 # ===== REVIEWS API =====
 @app.route('/api/reviews/<int:ad_id>', methods=['GET'])
+@conditional_on(lambda args: [f'reviews:{args["ad_id"]}', 'users'])
+@cached_response(lambda args, reviews: {f'reviews:{args["ad_id"]}'})
 def get_reviews(ad_id):
     """Get all reviews for a product"""
     try:
@@ -1310,6 +3582,7 @@ def add_review():
         ''', (ad_id, user_id, rating, review_text))
         
         db.commit()
+        invalidate_cache(f'ad:{ad_id}', f'reviews:{ad_id}', f'store:{ad_row[0] if ad_row else None}')
         review_id = cursor.lastrowid
         db.close()
         
@@ -1327,8 +3600,14 @@ def delete_review(review_id):
     try:
         db = get_db()
         cursor = db.cursor()
+        cursor.execute('''
+            SELECT r.adId, a.userId FROM reviews r LEFT JOIN ads a ON a.id = r.adId WHERE r.id = ?
+        ''', (review_id,))
+        row = cursor.fetchone()
         cursor.execute('DELETE FROM reviews WHERE id = ?', (review_id,))
         db.commit()
+        if row:
+            invalidate_cache(f'ad:{row[0]}', f'reviews:{row[0]}', f'store:{row[1]}')
         db.close()
         
         return jsonify({'success': True})
@@ -1340,35 +3619,31 @@ def delete_review(review_id):
 
 
 @app.route('/api/reviews/stats/<int:ad_id>', methods=['GET'])
+@conditional_on(lambda args: [f'reviews:{args["ad_id"]}'])
+@cached_response(lambda args, stats: {f'reviews:{args["ad_id"]}'})
 def get_review_stats(ad_id):
     """Get review statistics for a product"""
     try:
         db = get_db()
         cursor = db.cursor()
+        # Stats are kept up to date on the ad row by the reviews_stats_* triggers
         cursor.execute('''
-            SELECT 
-                COUNT(*) as totalReviews,
-                AVG(rating) as averageRating,
-                SUM(CASE WHEN rating = 5 THEN 1 ELSE 0 END) as fiveStars,
-                SUM(CASE WHEN rating = 4 THEN 1 ELSE 0 END) as fourStars,
-                SUM(CASE WHEN rating = 3 THEN 1 ELSE 0 END) as threeStars,
-                SUM(CASE WHEN rating = 2 THEN 1 ELSE 0 END) as twoStars,
-                SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) as oneStar
-            FROM reviews
-            WHERE adId = ?
+            SELECT reviewCount, ratingSum, rating5, rating4, rating3, rating2, rating1
+            FROM ads
+            WHERE id = ?
         ''', (ad_id,))
         
-        row = cursor.fetchone()
+        row = cursor.fetchone() or (0,) * 7
         db.close()
         
         stats = {
-            'totalReviews': row[0] or 0,
-            'averageRating': round(row[1], 1) if row[1] else 0,
-            'fiveStars': row[2] or 0,
-            'fourStars': row[3] or 0,
-            'threeStars': row[4] or 0,
-            'twoStars': row[5] or 0,
-            'oneStar': row[6] or 0
+            'totalReviews': row[0],
+            'averageRating': round(row[1] / row[0], 1) if row[0] else 0,
+            'fiveStars': row[2],
+            'fourStars': row[3],
+            'threeStars': row[4],
+            'twoStars': row[5],
+            'oneStar': row[6]
         }
         
         return jsonify(stats)
@@ -1418,13 +3693,245 @@ def can_review(ad_id):
         return jsonify({'error': 'database error'}), 500
 
 
+PUBLIC_DIR = BASE_DIR / 'public'
+# Text assets are held in memory, fingerprinted and served precompressed
+STATIC_TEXT_TYPES = {'.html', '.css', '.js', '.svg', '.json', '.txt'}
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Uploads from before content addressing are unique per upload but not immutable
+LEGACY_UPLOAD_MAX_AGE = 24 * 3600
+# Local css/js/svg referenced from HTML, rewritten to their fingerprinted URL
+STATIC_REFERENCE_RE = re.compile(r'(href|src)="/([\w./-]+\.(?:css|js|svg))"')
+FINGERPRINTED_RE = re.compile(r'^(.+)\.([0-9a-f]{12})(\.\w+)$')
+CONTENT_ADDRESSED_RE = re.compile(r'^uploads/(variants/)?[0-9a-f]{64}(-\d+w)?\.\w+$')
+
+_static_assets = {}
+
+
+class StaticAsset:
+    """A text file from public/ kept in memory with its hash and compressed copies"""
+
+    def __init__(self, path, body):
+        if path.endswith('.html'):
+            body = STATIC_REFERENCE_RE.sub(
+                lambda m: f'{m.group(1)}="/{fingerprint_path(m.group(2))}"', body.decode()).encode()
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.hash = hashlib.sha256(body).hexdigest()[:12]
+        self.encoded = {'identity': body}
+        self.lock = threading.Lock()
+
+    def encode(self, encoding):
+        """The body in `encoding`, compressed on first use; None if that doesn't shrink it"""
+        with self.lock:
+            if encoding not in self.encoded:
+                body = self.encoded['identity']
+                data = brotli.compress(body) if encoding == 'br' else gzip.compress(body, 9, mtime=0)
+                self.encoded[encoding] = data if len(data) < len(body) else None
+            return self.encoded[encoding]
+
+    def response(self, immutable=False):
+        encoding, data = 'identity', self.encoded['identity']
+        for candidate in ('br', 'gzip'):
+            if (candidate != 'br' or brotli) and request.accept_encodings[candidate]:
+                encoded = self.encode(candidate)
+                if encoded is not None:
+                    encoding, data = candidate, encoded
+                    break
+        response = Response(data, mimetype=self.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f'{self.hash}-{encoding}')
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+def static_asset(path):
+    """The StaticAsset for a text file under public/, or None.
+
+    Assets are built once per process; in debug mode they are rebuilt on
+    every request so edits show up without a restart.
+    """
+    if Path(path).suffix not in STATIC_TEXT_TYPES:
+        return None
+    asset = _static_assets.get(path)
+    if asset is not None and not app.debug:
+        return asset
+    full_path = safe_join(str(PUBLIC_DIR), path)
+    if full_path is None or not os.path.isfile(full_path):
+        return None
+    with open(full_path, 'rb') as f:
+        asset = StaticAsset(path, f.read())
+    _static_assets[path] = asset
+    return asset
+
+
+def fingerprint_path(path):
+    """styles.css -> styles.<hash>.css, for a text asset under public/"""
+    asset = static_asset(path)
+    if asset is None:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f'{stem}.{asset.hash}{extension}'
+
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
     # Serve static files from public/, fallback to index.html
-    if path != '' and (BASE_DIR / 'public' / path).exists():
-        return send_from_directory(str(BASE_DIR / 'public'), path)
-    return send_from_directory(str(BASE_DIR / 'public'), 'index.html')
+    path = path or 'index.html'
+    match = FINGERPRINTED_RE.match(path)
+    if match:
+        asset = static_asset(match.group(1) + match.group(3))
+        if asset is not None:
+            # A stale fingerprint still gets the current file, just not cached for good
+            return asset.response(immutable=asset.hash == match.group(2))
+    asset = static_asset(path)
+    if asset is not None:
+        return asset.response()
+    full_path = safe_join(str(PUBLIC_DIR), path)
+    if full_path is not None and os.path.isfile(full_path):
+        if CONTENT_ADDRESSED_RE.match(path):
+            response = send_from_directory(str(PUBLIC_DIR), path, max_age=STATIC_IMMUTABLE_MAX_AGE)
+            response.cache_control.immutable = True
+            return response
+        max_age = LEGACY_UPLOAD_MAX_AGE if path.startswith('uploads/') else None
+        return send_from_directory(str(PUBLIC_DIR), path, max_age=max_age)
+    # Extensionless paths are client-side pages; missing files and APIs are 404s
+    if path.startswith(('api/', 'uploads/')) or Path(path).suffix:
+        return jsonify({'error': 'not found'}), 404
+    return static_asset('index.html').response()
+
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """Render WebP variants for ad images uploaded before variants existed."""
+    if Image is None:
+        print('Pillow is not installed; pip install Pillow first')
+        return
+    db = get_db()
+    cur = db.cursor()
+    done = {r[0] for r in cur.execute('SELECT DISTINCT sourceUrl FROM image_variants')}
+    urls = set()
+    for ad in cur.execute('SELECT imageUrl, images FROM ads').fetchall():
+        urls.update(ad_image_urls(ad['imageUrl'], ad['images']))
+    pending = [u for u in sorted(urls - done)
+               if u.startswith('/uploads/') and (UPLOADS_DIR / u.rsplit('/', 1)[-1]).is_file()]
+    pool = image_pool()
+    futures = [pool.submit(render_image_variants, str(UPLOADS_DIR / u.rsplit('/', 1)[-1]),
+                           IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_QUALITY) for u in pending]
+    for url, future in zip(pending, futures):
+        store_image_variants(url, future)
+    db.close()
+    print(f'rendered variants for {len(pending)} image(s)')
+
+
+@app.cli.command('import-uploads')
+def import_uploads_command():
+    """Move files uploaded before content addressing into the hashed store."""
+    db = get_db()
+    cur = db.cursor()
+    known = {r[0] for r in cur.execute('SELECT url FROM uploads')}
+    moved = 0
+    for path in sorted(UPLOADS_DIR.iterdir()):
+        old_url = f'/uploads/{path.name}'
+        if not path.is_file() or path.name.startswith('.') or old_url in known:
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        url, created = store_upload(str(path), digest.hexdigest(), path.stat().st_size, path.suffix.lower())
+        if not created and path.exists():
+            path.unlink()
+        cur.execute('BEGIN IMMEDIATE')
+        cur.execute('UPDATE ads SET imageUrl = ? WHERE imageUrl = ?', (url, old_url))
+        cur.execute('UPDATE ads SET images = replace(images, ?, ?) WHERE instr(images, ?) > 0', (old_url, url, old_url))
+        cur.execute('UPDATE users SET logo_path = ? WHERE logo_path = ?', (url, old_url))
+        cur.execute('UPDATE users SET profilePicture = ? WHERE profilePicture = ?', (url, old_url))
+        cur.execute('UPDATE OR IGNORE image_variants SET sourceUrl = ? WHERE sourceUrl = ?', (url, old_url))
+        cur.execute('DELETE FROM image_variants WHERE sourceUrl = ?', (old_url,))
+        refresh_image_variants(cur, 'WHERE imageUrl = ? OR instr(images, ?) > 0', (url, url))
+        db.commit()
+        known.add(url)
+        moved += 1
+    db.close()
+    print(f'imported {moved} file(s)')
+
+
+@app.cli.command('gc-uploads')
+@click.option('--grace-hours', default=24, show_default=True,
+              help='Keep unreferenced files uploaded more recently than this.')
+def gc_uploads_command(grace_hours):
+    """Delete uploaded files that no ad or user references any more."""
+    db = get_db()
+    urls, variant_urls = collect_unreferenced_uploads(db, grace_hours)
+    freed = 0
+    for url in urls + variant_urls:
+        path = UPLOADS_DIR / url[len('/uploads/'):]
+        # Skip a file whose content was uploaded again since the records went
+        if url in urls and db.execute('SELECT 1 FROM uploads WHERE url = ?', (url,)).fetchone():
+            continue
+        if path.is_file():
+            freed += path.stat().st_size
+            path.unlink()
+    # Temp files left behind by uploads interrupted by a crash
+    for path in UPLOADS_DIR.glob('.upload-*'):
+        if path.stat().st_mtime < time.time() - grace_hours * 3600:
+            freed += path.stat().st_size
+            path.unlink()
+    db.close()
+    print(f'deleted {len(urls)} upload(s), {freed} bytes freed')
+
+
+@app.cli.command('reconcile-unread-counts')
+def reconcile_unread_counts_command():
+    """Rebuild conversation and per-user unread counters from messages."""
+    db = get_db()
+    fixed = reconcile_unread_counts(db)
+    db.close()
+    print(f'unread counts corrected for {fixed} user(s)')
+
+
+@app.cli.command('reconcile-review-stats')
+def reconcile_review_stats_command():
+    """Recompute the review stats stored on ads from the reviews table."""
+    db = get_db()
+    fixed = reconcile_review_stats(db)
+    db.close()
+    print(f'review stats corrected on {fixed} ad(s)')
+
+
+@app.cli.command('purge-orphans')
+def purge_orphans_command():
+    """Delete rows left behind by deleted users, ads and conversations."""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    cur.execute(f"UPDATE conversations AS t SET listingId = NULL WHERE {missing('ads', 'listingId')}")
+    detached = cur.rowcount
+    db.commit()
+    deleted = purge_orphans(db)
+    # Counters kept by application code rather than triggers
+    if deleted['conversations'] or deleted['messages']:
+        reconcile_unread_counts(db)
+    db.close()
+    for table, count in deleted.items():
+        print(f'{table}: {count} orphaned row(s) deleted')
+    print(f'conversations: {detached} detached from deleted listings')
+
+
+@app.cli.command('reconcile-wishlist-counts')
+def reconcile_wishlist_counts_command():
+    """Recompute the wishlist counts stored on ads from the wishlist table."""
+    db = get_db()
+    fixed = reconcile_wishlist_counts(db)
+    db.close()
+    print(f'wishlist counts corrected on {fixed} ad(s)')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+"""Times the listing endpoints as the reviews table grows.
+
+GET /api/ads reads review counts and averages from the stats stored on each
+ad, so its latency should not depend on how many reviews exist. This builds a
+throwaway database, adds reviews in steps and reports the median time of each
+endpoint at every step, plus how many SELECTs one request ran.
+
+    python benchmarks/bench_reviews.py [--ads 2000] [--steps 0,20000,100000,400000]
+
+Exits non-zero when the slowest step of an endpoint takes more than
+--max-ratio times its fastest one.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='spicetrade-bench-'), 'db.sqlite')
+os.environ['CACHE_TTL'] = '0'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+ENDPOINTS = [
+    '/api/ads?limit=20',
+    '/api/ads?limit=100',
+    '/api/ads?limit=20&cursor={cursor}',
+    '/api/ads/{ad}',
+    '/api/reviews/stats/{ad}',
+]
+
+
+def seed(db, ads, users):
+    db.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, 'x', ?)",
+                   [(f'User {i}', f'user{i}@example.com', 'seller' if i < 50 else 'buyer')
+                    for i in range(users)])
+    db.executemany("INSERT INTO ads (title, description, userId, price, createdAt) "
+                   "VALUES (?, 'bench', ?, 10, datetime('now', ?))",
+                   [(f'Ad {i}', 1 + i % 50, f'-{i} minutes') for i in range(ads)])
+    db.commit()
+
+
+def add_reviews(db, pairs, count):
+    """Insert the next count (user, ad) reviews; triggers keep the ad stats current"""
+    batch = [(ad, user, random.randint(1, 5)) for user, ad in pairs[:count]]
+    del pairs[:count]
+    db.executemany("INSERT INTO reviews (adId, userId, rating, reviewText) VALUES (?, ?, ?, '')", batch)
+    db.commit()
+
+
+def time_endpoint(client, conn, url, repeat):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    client.get(url)
+    conn.set_trace_callback(None)
+    selects = sum(1 for s in statements if s.lstrip().upper().startswith(('SELECT', 'WITH')))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return statistics.median(samples), selects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ads', type=int, default=2000)
+    parser.add_argument('--steps', default='0,20000,100000,400000',
+                        help='total reviews to measure at, comma separated')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--max-ratio', type=float, default=3.0)
+    args = parser.parse_args()
+
+    steps = [int(s) for s in args.steps.split(',')]
+    users = max(60, -(-steps[-1] // args.ads) + 50)
+    random.seed(1)
+
+    db = app.connect_db()
+    seed(db, args.ads, users)
+    ad_ids = [r[0] for r in db.execute('SELECT id FROM ads')]
+    user_ids = [r[0] for r in db.execute("SELECT id FROM users WHERE role = 'buyer'")]
+    pairs = [(user, ad) for user in user_ids for ad in ad_ids]
+    random.shuffle(pairs)
+
+    client = app.app.test_client()
+    with app.app.app_context():
+        conn = app.get_db()
+    params = {'ad': ad_ids[len(ad_ids) // 2], 'cursor': app.encode_cursor(
+        db.execute('SELECT createdAt FROM ads WHERE id = ?', (ad_ids[len(ad_ids) // 2],)).fetchone()[0],
+        ad_ids[len(ad_ids) // 2])}
+
+    results = {url: [] for url in ENDPOINTS}
+    total = 0
+    print(f'{args.ads} ads, median of {args.repeat} requests (ms)')
+    print(f"{'reviews':>8}  " + '  '.join(f'{url:>34}' for url in ENDPOINTS))
+    for step in steps:
+        add_reviews(db, pairs, step - total)
+        total = step
+        row = []
+        for url in ENDPOINTS:
+            ms, selects = time_endpoint(client, conn, url.format(**params), args.repeat)
+            results[url].append(ms)
+            row.append(f'{ms:8.2f} ms, {selects} SELECTs')
+        print(f'{total:>8}  ' + '  '.join(f'{cell:>34}' for cell in row))
+    db.close()
+
+    failed = False
+    for url, times in results.items():
+        ratio = max(times) / min(times)
+        if ratio > args.max_ratio:
+            print(f'{url}: slowest step is {ratio:.1f}x the fastest (limit {args.max_ratio}x)')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
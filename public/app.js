@@ -45,21 +45,27 @@ if (signupForm) {
 const searchForm = document.getElementById("searchForm");
 const searchInput = document.getElementById("q");
 let searchTimeout = null;
-let allAds = []; // Cache all ads for faster filtering
+// Pages of the current search loaded so far; the sidebar filters are applied
+// by the server, and more pages load with the X-Next-Cursor of the last one
+const SEARCH_PAGE_SIZE = 48;
+let searchResults = [];
+let searchNextCursor = null;
 
-// Fetch all ads once for search
-async function fetchAllAds() {
+// Ranked full-text search on the server
+async function fetchSearchResults(query, params = {}) {
+  const qs = new URLSearchParams({ q: query, ...params });
   try {
-    const res = await fetch("/api/ads");
-    allAds = await res.json();
+    const res = await fetch(`/api/search?${qs}`);
+    if (!res.ok) return [];
+    return await res.json();
   } catch (err) {
-    console.error("Failed to fetch ads:", err);
-    allAds = [];
+    console.error("Search failed:", err);
+    return [];
   }
 }
 
-// Enhanced search function that searches across multiple fields
-function performSearch(query) {
+// Search function: the server matches title, description, tags and store name
+async function performSearch(query) {
   const listingsTitle = document.getElementById("listingsTitle");
   const searchResultsContainer = document.getElementById("searchResultsContainer");
   const homeContent = document.getElementById("homeContent");
@@ -69,7 +75,7 @@ function performSearch(query) {
     // Show home content, hide search results
     if (searchResultsContainer) searchResultsContainer.style.display = "none";
     if (homeContent) homeContent.style.display = "block";
-    renderAds(allAds);
+    loadAds();
     if (listingsTitle) {
       listingsTitle.textContent = "Latest Buyer Requirements";
     }
@@ -80,58 +86,69 @@ function performSearch(query) {
   if (searchResultsContainer) searchResultsContainer.style.display = "block";
   if (homeContent) homeContent.style.display = "none";
 
-  const q = query.toLowerCase().trim();
-  const searchTerms = q.split(/\s+/); // Split by spaces for multi-word search
-
-  const filtered = allAds.filter((ad) => {
-    // Search in title
-    const titleMatch = (ad.title || "").toLowerCase().includes(q);
-    
-    // Search in description
-    const descMatch = (ad.description || "").toLowerCase().includes(q);
-    
-    // Search in tags
-    const tagsMatch = ad.tags && ad.tags.some(tag => 
-      tag.toLowerCase().includes(q)
-    );
-    
-    // Search in category
-    const categoryMatch = (ad.category || "").toLowerCase().includes(q);
-    
-    // Search in author/store name
-    const authorMatch = (ad.author || "").toLowerCase().includes(q);
-    
-    // Multi-word search: check if all terms match at least one field
-    const multiWordMatch = searchTerms.every(term => {
-      const t = term.toLowerCase();
-      return (
-        (ad.title || "").toLowerCase().includes(t) ||
-        (ad.description || "").toLowerCase().includes(t) ||
-        (ad.category || "").toLowerCase().includes(t) ||
-        (ad.author || "").toLowerCase().includes(t) ||
-        (ad.tags && ad.tags.some(tag => tag.toLowerCase().includes(t)))
-      );
-    });
-
-    return titleMatch || descMatch || tagsMatch || categoryMatch || authorMatch || multiWordMatch;
-  });
-
   // Update breadcrumb
   if (searchBreadcrumb) {
     searchBreadcrumb.textContent = `Results for "${query}"`;
   }
 
-  // Update results count
+  // A new query starts unfiltered; its first page supplies the filter options
+  await loadSearchPage(query.trim(), new URLSearchParams(), false);
+  buildFilters(searchResults);
+}
+
+// The sidebar filters as /api/search query params
+function searchFilterParams() {
+  const params = new URLSearchParams();
+  const checked = (selector) =>
+    Array.from(document.querySelectorAll(`${selector}:checked`)).map((cb) => cb.value);
+  checked(".category-filter").forEach((v) => params.append("category", v));
+  checked(".tag-filter").forEach((v) => params.append("tag", v));
+  checked(".store-filter").forEach((v) => params.append("author", v));
+  const minPrice = parseFloat(document.getElementById("minPrice")?.value);
+  const maxPrice = parseFloat(document.getElementById("maxPrice")?.value);
+  if (!isNaN(minPrice) && minPrice >= 0) params.set("minPrice", minPrice);
+  if (!isNaN(maxPrice) && maxPrice >= 0) params.set("maxPrice", maxPrice);
+  return params;
+}
+
+// Fetch a page of results for query and filters; append adds it to the ones shown
+async function loadSearchPage(query, filters, append) {
+  const params = new URLSearchParams(filters);
+  params.set("q", query);
+  params.set("limit", SEARCH_PAGE_SIZE);
+  if (append && searchNextCursor) params.set("cursor", searchNextCursor);
+  let page = [];
+  let next = null;
+  try {
+    const res = await fetch(`/api/search?${params}`);
+    if (res.ok) {
+      page = await res.json();
+      next = res.headers.get("X-Next-Cursor");
+    }
+  } catch (err) {
+    console.error("Search failed:", err);
+  }
+  // Drop stale responses if the user searched again meanwhile
+  if (document.getElementById("q")?.value.trim() !== query) return;
+
+  searchResults = append ? searchResults.concat(page) : page;
+  searchNextCursor = next;
+  currentFilteredResults = searchResults;
+
   const resultsCount = document.getElementById("resultsCount");
   if (resultsCount) {
-    resultsCount.textContent = `${filtered.length} result${filtered.length !== 1 ? 's' : ''} for "${query}"`;
+    const n = searchResults.length;
+    resultsCount.textContent = `${n}${next ? "+" : ""} result${n !== 1 ? "s" : ""} for "${query}"`;
   }
+  const loadMore = document.getElementById("searchLoadMore");
+  if (loadMore) loadMore.style.display = next ? "inline-block" : "none";
 
-  // Render Amazon-style results
-  renderAmazonResults(filtered, query);
-  
-  // Build filters from results
-  buildFilters(filtered);
+  const sortSelect = document.getElementById("sortSelect");
+  if (sortSelect) {
+    applySorting(searchResults, sortSelect.value);
+  } else {
+    renderAmazonResults(searchResults, query);
+  }
 }
 
 // Render products in Amazon-style grid
@@ -306,78 +323,12 @@ function buildFilters(products) {
   }
 }
 
-// Apply filters to search results
+// Re-run the search with the sidebar filters (results shown, for sorting)
 let currentFilteredResults = [];
 
 function applyFilters() {
   const query = document.getElementById("q").value.trim();
-  
-  // Get base filtered results
-  const q = query.toLowerCase().trim();
-  const searchTerms = q.split(/\s+/);
-  
-  let filtered = allAds.filter((ad) => {
-    const titleMatch = (ad.title || "").toLowerCase().includes(q);
-    const descMatch = (ad.description || "").toLowerCase().includes(q);
-    const tagsMatch = ad.tags && ad.tags.some(tag => tag.toLowerCase().includes(q));
-    const categoryMatch = (ad.category || "").toLowerCase().includes(q);
-    const authorMatch = (ad.author || "").toLowerCase().includes(q);
-    const multiWordMatch = searchTerms.every(term => {
-      const t = term.toLowerCase();
-      return (
-        (ad.title || "").toLowerCase().includes(t) ||
-        (ad.description || "").toLowerCase().includes(t) ||
-        (ad.category || "").toLowerCase().includes(t) ||
-        (ad.author || "").toLowerCase().includes(t) ||
-        (ad.tags && ad.tags.some(tag => tag.toLowerCase().includes(t)))
-      );
-    });
-    return titleMatch || descMatch || tagsMatch || categoryMatch || authorMatch || multiWordMatch;
-  });
-  
-  // Apply category filters
-  const selectedCategories = Array.from(document.querySelectorAll('.category-filter:checked')).map(cb => cb.value);
-  if (selectedCategories.length > 0) {
-    filtered = filtered.filter(ad => selectedCategories.includes(ad.category));
-  }
-  
-  // Apply tag filters
-  const selectedTags = Array.from(document.querySelectorAll('.tag-filter:checked')).map(cb => cb.value);
-  if (selectedTags.length > 0) {
-    filtered = filtered.filter(ad => ad.tags && ad.tags.some(tag => selectedTags.includes(tag)));
-  }
-  
-  // Apply store filters
-  const selectedStores = Array.from(document.querySelectorAll('.store-filter:checked')).map(cb => cb.value);
-  if (selectedStores.length > 0) {
-    filtered = filtered.filter(ad => selectedStores.includes(ad.author));
-  }
-  
-  // Apply price filter
-  const minPrice = parseFloat(document.getElementById("minPrice")?.value);
-  const maxPrice = parseFloat(document.getElementById("maxPrice")?.value);
-  if (!isNaN(minPrice) && minPrice >= 0) {
-    filtered = filtered.filter(ad => ad.price && parseFloat(ad.price) >= minPrice);
-  }
-  if (!isNaN(maxPrice) && maxPrice >= 0) {
-    filtered = filtered.filter(ad => ad.price && parseFloat(ad.price) <= maxPrice);
-  }
-  
-  currentFilteredResults = filtered;
-  
-  // Update results count
-  const resultsCount = document.getElementById("resultsCount");
-  if (resultsCount) {
-    resultsCount.textContent = `${filtered.length} result${filtered.length !== 1 ? 's' : ''}`;
-  }
-  
-  // Apply sorting
-  const sortSelect = document.getElementById("sortSelect");
-  if (sortSelect) {
-    applySorting(filtered, sortSelect.value);
-  } else {
-    renderAmazonResults(filtered, query);
-  }
+  if (query) loadSearchPage(query, searchFilterParams(), false);
 }
 
 // Apply sorting
@@ -424,10 +375,6 @@ if (searchForm) {
       return;
     }
     
-    if (allAds.length === 0) {
-      await fetchAllAds();
-    }
-    
     performSearch(query);
   });
 }
@@ -436,9 +383,6 @@ if (searchForm) {
 let selectedSuggestionIndex = -1;
 
 if (searchInput) {
-  // Fetch ads when page loads
-  fetchAllAds();
-  
   const clearBtn = document.getElementById("clearSearch");
   const suggestionsDropdown = document.getElementById("searchSuggestions");
   
@@ -450,9 +394,10 @@ if (searchInput) {
       clearBtn.style.display = query ? "flex" : "none";
     }
     
-    // Show autocomplete suggestions
+    // Show autocomplete suggestions once typing pauses
+    clearTimeout(searchTimeout);
     if (query && query.length >= 2) {
-      showSearchSuggestions(query);
+      searchTimeout = setTimeout(() => showSearchSuggestions(query), 150);
     } else {
       hideSuggestions();
     }
@@ -525,24 +470,18 @@ if (searchInput) {
 }
 
 // Show search suggestions dropdown
-function showSearchSuggestions(query) {
-  if (allAds.length === 0) return;
-  
+async function showSearchSuggestions(query) {
   const suggestionsDropdown = document.getElementById("searchSuggestions");
   if (!suggestionsDropdown) return;
   
-  const q = query.toLowerCase().trim();
-  
-  // Find matching products
-  const matches = allAds.filter((ad) => {
-    const titleMatch = (ad.title || "").toLowerCase().includes(q);
-    const descMatch = (ad.description || "").toLowerCase().includes(q);
-    const tagsMatch = ad.tags && ad.tags.some(tag => tag.toLowerCase().includes(q));
-    const categoryMatch = (ad.category || "").toLowerCase().includes(q);
-    const authorMatch = (ad.author || "").toLowerCase().includes(q);
-    
-    return titleMatch || descMatch || tagsMatch || categoryMatch || authorMatch;
-  }).slice(0, 8); // Show max 8 suggestions
+  // Find matching products (max 8 suggestions)
+  const matches = await fetchSearchResults(query, {
+    limit: 8,
+    fields: "title,price,category,imageUrl",
+    imageWidth: 160,
+  });
+  // Drop stale responses if the user kept typing
+  if (searchInput.value.trim() !== query) return;
   
   if (matches.length === 0) {
     suggestionsDropdown.innerHTML = '<div class="search-no-suggestions">No matching products found</div>';
@@ -646,6 +585,11 @@ function updateSuggestionHighlight(suggestions) {
   });
 }
 
+// Fields renderAds reads; list fetches ask only for these
+const AD_LIST_FIELDS =
+  "title,description,tags,author,profilePicture,createdAt,imageUrl";
+const HOME_REQUIREMENTS_LIMIT = 24;
+
 function renderAds(ads) {
   const list = document.getElementById("adsList");
   if (!list) return;
@@ -746,28 +690,26 @@ function renderAds(ads) {
 
 async function loadAds() {
   const list = document.getElementById("adsList");
-  if (!list) return;
+  // Pages that page through /api/ads themselves mark their list data-paged
+  if (!list || list.dataset.paged) return;
   list.innerHTML = "Loading...";
   try {
-    const res = await fetch("/api/ads");
-    let ads = await res.json();
-
-    // Filter ads by current user if on dashboard page
-    if (window.location.pathname.includes("/dashboard.html")) {
+    // On the dashboard page only the current user's ads are shown; the home
+    // page shows the latest buyer requirements (not seller products)
+    const params = `imageWidth=640&fields=${AD_LIST_FIELDS}`;
+    let url = `/api/ads?type=requirement&limit=${HOME_REQUIREMENTS_LIMIT}&${params}`;
+    const onDashboard = window.location.pathname.includes("/dashboard.html");
+    if (onDashboard) {
       const user = JSON.parse(
         localStorage.getItem("spicetrade_user") || "null"
       );
       if (user && user.id) {
-        ads = ads.filter((ad) => ad.userId === user.id);
+        url = `/api/users/${user.id}/ads?${params}`;
       }
     }
-    // On home page, show only buyer requirements (not seller products)
-    else if (
-      window.location.pathname === "/" ||
-      window.location.pathname === "/index.html"
-    ) {
-      ads = ads.filter((ad) => ad.role === "buyer" || (!ad.role && !ad.price));
-    }
+    const res = await fetch(url);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const ads = await res.json();
 
     renderAds(ads);
   } catch (err) {
@@ -904,6 +846,31 @@ function updateHeader() {
 
 updateHeader();
 
+// Show the unread message count in the header
+function showUnreadCount(unreadCount) {
+  const badge = document.getElementById("messagesBadge");
+  const userIcon = document.getElementById("userNotificationIcon");
+  if (unreadCount > 0) {
+    if (badge) {
+      badge.textContent = unreadCount;
+      badge.style.display = "inline-block";
+    }
+
+    // Show notification icon on user welcome text
+    if (userIcon) {
+      userIcon.style.display = "inline-block";
+    }
+  } else {
+    if (badge) {
+      badge.style.display = "none";
+    }
+    // Hide notification icon when no unread messages
+    if (userIcon) {
+      userIcon.style.display = "none";
+    }
+  }
+}
+
 // Fetch and update unread message count
 async function updateMessageNotification() {
   const user = JSON.parse(localStorage.getItem("spicetrade_user") || "null");
@@ -912,50 +879,95 @@ async function updateMessageNotification() {
   try {
     const response = await fetch(`/api/messages/unread/${user.id}`);
     const data = await response.json();
-
-    if (data.unreadCount > 0) {
-      const badge = document.getElementById("messagesBadge");
-      if (badge) {
-        badge.textContent = data.unreadCount;
-        badge.style.display = "inline-block";
-      }
-
-      // Show notification icon on user welcome text
-      const userIcon = document.getElementById("userNotificationIcon");
-      if (userIcon) {
-        userIcon.style.display = "inline-block";
-      }
-    } else {
-      // Hide notification icon when no unread messages
-      const userIcon = document.getElementById("userNotificationIcon");
-      if (userIcon) {
-        userIcon.style.display = "none";
-      }
-    }
+    showUnreadCount(data.unreadCount);
   } catch (error) {
     console.error("Failed to fetch unread count:", error);
   }
 }
 
-// Check for new messages every 10 seconds
-updateMessageNotification();
-setInterval(updateMessageNotification, 10000);
+// Live updates over Server-Sent Events, opened only on pages that mark their
+// <body data-live-events> (each stream holds a server thread). The server
+// pushes the unread count, new messages and read receipts; pages listen for
+// "spicetrade:message" and "spicetrade:read" on window instead of polling.
+// Null when unavailable; if the server turns the stream away (503 when it
+// is at capacity) it becomes null again and "spicetrade:offline" is fired.
+let liveEvents = null;
+
+// Pages without a stream refresh the unread badge once a minute, and only
+// while the tab is visible; coming back to a tab refreshes it right away
+const UNREAD_POLL_MS = 60000;
+const UNREAD_MIN_GAP_MS = 10000;
+let unreadPolling = false;
+let unreadCheckedAt = 0;
+
+function checkUnreadIfVisible(minGap) {
+  if (document.visibilityState !== "visible") return;
+  if (Date.now() - unreadCheckedAt < minGap) return;
+  unreadCheckedAt = Date.now();
+  updateMessageNotification();
+}
+
+function pollUnreadCount() {
+  if (unreadPolling) return;
+  unreadPolling = true;
+  checkUnreadIfVisible(0);
+  setInterval(() => checkUnreadIfVisible(UNREAD_POLL_MS / 2), UNREAD_POLL_MS);
+  document.addEventListener("visibilitychange", () =>
+    checkUnreadIfVisible(UNREAD_MIN_GAP_MS)
+  );
+}
+
+function connectLiveEvents() {
+  const user = JSON.parse(localStorage.getItem("spicetrade_user") || "null");
+  if (!user || !user.id || !window.EventSource) return null;
+
+  const source = new EventSource(`/api/events/${user.id}`);
+  source.addEventListener("unread", (e) => {
+    showUnreadCount(JSON.parse(e.data).unreadCount);
+  });
+  ["message", "read"].forEach((type) => {
+    source.addEventListener(type, (e) => {
+      window.dispatchEvent(
+        new CustomEvent(`spicetrade:${type}`, { detail: JSON.parse(e.data) })
+      );
+    });
+  });
+  source.addEventListener("error", () => {
+    // EventSource retries dropped connections itself; it only gives up
+    // (CLOSED) on an error response such as 503
+    if (source.readyState !== EventSource.CLOSED) return;
+    liveEvents = null;
+    pollUnreadCount();
+    window.dispatchEvent(new CustomEvent("spicetrade:offline"));
+  });
+  return source;
+}
+
+if ("liveEvents" in document.body.dataset) {
+  liveEvents = connectLiveEvents();
+}
+if (!liveEvents) {
+  pollUnreadCount();
+}
 
 function filterByCategory(cat) {
   const qInput = document.getElementById("q");
   if (qInput) qInput.value = cat;
   const list = document.getElementById("adsList");
   if (list) list.innerHTML = "Loading...";
-  fetch("/api/ads")
-    .then((r) => r.json())
+  const qs = new URLSearchParams({
+    q: cat || "",
+    limit: HOME_REQUIREMENTS_LIMIT,
+    fields: AD_LIST_FIELDS,
+    imageWidth: 640,
+  });
+  fetch(`/api/search?${qs}`)
+    .then((r) => {
+      if (!r.ok) throw new Error(`HTTP ${r.status}`);
+      return r.json();
+    })
     .then((ads) => {
-      const keyword = (cat || "").toLowerCase();
-      const filtered = ads.filter(
-        (a) =>
-          (a.title || "").toLowerCase().includes(keyword) ||
-          (a.description || "").toLowerCase().includes(keyword)
-      );
-      renderAds(filtered);
+      renderAds(ads);
       document
         .querySelectorAll(".sub-header .cat, .header-tags .cat")
         .forEach((el) => {
@@ -988,6 +1000,14 @@ if (sortSelect) {
   });
 }
 
+const searchLoadMoreBtn = document.getElementById("searchLoadMore");
+if (searchLoadMoreBtn) {
+  searchLoadMoreBtn.addEventListener("click", () => {
+    const query = document.getElementById("q")?.value.trim();
+    if (query) loadSearchPage(query, searchFilterParams(), true);
+  });
+}
+
 const applyPriceBtn = document.getElementById("applyPriceFilter");
 if (applyPriceBtn) {
   applyPriceBtn.addEventListener("click", applyFilters);
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# app.py builds its database with init_db() at import time, so point it at a
+# throwaway file first. The response cache is off so every request hits SQLite.
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='spicetrade-tests-'), 'db.sqlite')
+os.environ['CACHE_TTL'] = '0'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as spicetrade  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def client():
+    return spicetrade.app.test_client()
+
+
+@pytest.fixture
+def db():
+    conn = spicetrade.connect_db()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope='session')
+def api(client):
+    def call(method, url, body=None):
+        """Call a JSON endpoint and return the decoded body, failing on any error status"""
+        response = client.open(url, method=method, json=body)
+        assert response.status_code < 300, (method, url, response.status_code, response.get_data(as_text=True))
+        return response.get_json()
+    return call
+
+
+@pytest.fixture(scope='session')
+def make_user(api):
+    count = 0
+
+    def make(role):
+        nonlocal count
+        count += 1
+        return api('POST', '/api/signup', {
+            'email': f'{role}{count}@example.com', 'password': 'password123',
+            'name': f'{role.title()} {count}', 'role': role, 'storeName': f'Store {count}',
+        })['id']
+    return make
+
+
+@pytest.fixture(scope='session')
+def make_ad(api):
+    def make(user_id, **fields):
+        body = {'title': 'Black pepper', 'description': 'Whole black pepper', 'userId': user_id,
+                'category': 'Spices', 'tags': ['pepper'], 'price': 5}
+        body.update(fields)
+        return api('POST', '/api/ads', body)['id']
+    return make
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Turn the response cache on (it is off for the rest of the suite)"""
+    monkeypatch.setattr(spicetrade, 'CACHE_TTL', 60)
+    monkeypatch.setattr(spicetrade, 'response_cache', spicetrade.LocalCache(spicetrade.CACHE_MAX_ENTRIES, 60))
@@ -0,0 +1,54 @@
+"""ETags only change for responses whose content changed."""
+import app
+
+
+def revalidate(client, url):
+    etag = client.get(url).headers['ETag']
+    return lambda: client.get(url, headers={'If-None-Match': etag}).status_code
+
+
+def test_view_flush_changes_only_responses_with_views(client, make_user, make_ad):
+    seller = make_user('seller')
+    ad = make_ad(seller)
+    with_views = revalidate(client, '/api/ads?limit=20')
+    without_views = revalidate(client, '/api/ads?limit=20&fields=title,price')
+    stores = revalidate(client, '/api/stores?limit=20')
+    store = revalidate(client, f'/api/stores/{seller}')
+
+    client.post(f'/api/ads/{ad}/view')
+    app.view_counter.flush()
+
+    assert with_views() == 200
+    assert without_views() == 304
+    assert stores() == 304
+    assert store() == 304
+
+
+def test_view_flush_refreshes_cached_ad(client, make_user, make_ad, cache):
+    ad = make_ad(make_user('seller'))
+    assert client.get(f'/api/ads/{ad}').get_json()['views'] in (0, None)
+    assert client.get(f'/api/ads/{ad}').headers['X-Cache'] == 'HIT'
+
+    client.post(f'/api/ads/{ad}/view')
+    client.post(f'/api/ads/{ad}/view')
+    app.view_counter.flush()
+
+    assert client.get(f'/api/ads/{ad}').get_json()['views'] == 2
+
+
+def test_cached_ad_and_reviews_follow_writes_from_other_workers(client, make_user, make_ad, cache, db):
+    seller, buyer = make_user('seller'), make_user('buyer')
+    ad = make_ad(seller)
+    urls = [f'/api/ads/{ad}', f'/api/reviews/{ad}', f'/api/reviews/stats/{ad}']
+    for url in urls:
+        client.get(url)
+        assert client.get(url).headers['X-Cache'] == 'HIT'
+
+    # Written by another process: nothing invalidates this process's cache
+    db.execute("UPDATE ads SET title = 'Green cardamom' WHERE id = ?", (ad,))
+    db.execute('INSERT INTO reviews (adId, userId, rating) VALUES (?, ?, 5)', (ad, buyer))
+    db.commit()
+
+    assert client.get(urls[0]).get_json()['title'] == 'Green cardamom'
+    assert len(client.get(urls[1]).get_json()) == 1
+    assert client.get(urls[2]).get_json()['totalReviews'] == 1
@@ -0,0 +1,26 @@
+"""Several workers starting at once against the same database each run init_db()."""
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import app
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def test_concurrent_startup_applies_each_migration_once(tmp_path):
+    db_path = tmp_path / 'db.sqlite'
+    env = dict(os.environ, DB_PATH=str(db_path))
+    workers = [subprocess.Popen([sys.executable, '-c', 'import app'], cwd=REPO, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+               for _ in range(4)]
+    for worker in workers:
+        output, _ = worker.communicate(timeout=60)
+        assert worker.returncode == 0, output
+
+    conn = sqlite3.connect(db_path)
+    versions = [r[0] for r in conn.execute('SELECT version FROM schema_migrations ORDER BY version')]
+    assert versions == [version for version, _, _ in app.MIGRATIONS]
+    conn.close()
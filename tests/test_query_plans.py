@@ -0,0 +1,96 @@
+"""EXPLAIN QUERY PLAN checks for the hot read paths.
+
+Each endpoint is called with SQL tracing on, and every SELECT it ran is
+explained. A plan may walk an index in ORDER BY order (that is how a LIMIT
+page is read) or scan a CTE page it already narrowed down, but it must
+never scan a whole table.
+"""
+import re
+
+import pytest
+
+import app
+
+# "SCAN r" is a full scan of whatever r names; index walks, virtual tables
+# and subqueries read "SCAN r USING INDEX ...", "SCAN (subquery-1)" etc.
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+CTE_NAME = re.compile(r'(\w+)\s+AS\s+\(', re.IGNORECASE)
+
+
+def cte_names(sql):
+    """Names a statement's CTEs can be scanned under, aliases included"""
+    names = set(CTE_NAME.findall(sql))
+    for name in list(names):
+        names.update(re.findall(rf'\b(?:FROM|JOIN)\s+{name}\s+(?:AS\s+)?(\w+)', sql, re.IGNORECASE))
+    return names
+
+
+@pytest.fixture(scope='module')
+def seeded(api, make_user, make_ad):
+    seller = make_user('seller')
+    buyer = make_user('buyer')
+    ad = make_ad(seller)
+    make_ad(buyer, title='Need cardamom', price=0)
+    api('POST', '/api/reviews', {'adId': ad, 'userId': buyer, 'rating': 4})
+    api('POST', '/api/wishlist', {'userId': buyer, 'adId': ad})
+    conversation = api('POST', '/api/conversations',
+                       {'buyerId': buyer, 'sellerId': seller, 'listingId': ad})['conversationId']
+    api('POST', '/api/messages', {'conversationId': conversation, 'senderId': buyer, 'message': 'hi'})
+    return {'seller': seller, 'buyer': buyer, 'ad': ad, 'conversation': conversation}
+
+
+@pytest.fixture
+def traced(client):
+    """Run a GET and return (statement, plan lines) for every SELECT it executed"""
+    with app.app.app_context():
+        conn = app.get_db()
+
+    def run(url):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            response = client.get(url)
+        finally:
+            conn.set_trace_callback(None)
+        assert response.status_code == 200, (url, response.get_data(as_text=True))
+        plans = []
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            plan = [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+            plans.append((sql, plan))
+        assert plans, f'{url} ran no queries'
+        return plans
+    return run
+
+
+HOT_URLS = [
+    '/api/ads?limit=20',
+    '/api/ads?limit=20&cursor={cursor}',
+    '/api/ads?type=product&limit=12',
+    '/api/ads?type=requirement&limit=24',
+    '/api/users/{seller}/ads?limit=20',
+    '/api/ads/{ad}',
+    '/api/reviews/{ad}',
+    '/api/reviews/stats/{ad}',
+    '/api/conversations/{buyer}',
+    '/api/messages/{conversation}?userId={buyer}',
+    '/api/messages/unread/{buyer}',
+    '/api/wishlist/{buyer}',
+    '/api/wishlist/{buyer}/ids',
+    '/api/stores?limit=20',
+    '/api/stores/{seller}',
+    '/api/admin/users?role=seller&limit=20',
+    '/api/search?q=pepper',
+]
+
+
+@pytest.mark.parametrize('url', HOT_URLS)
+def test_hot_queries_use_indexes(url, seeded, traced):
+    cursor = app.encode_cursor('9999-12-31 00:00:00', 2 ** 62)
+    for sql, plan in traced(url.format(cursor=cursor, **seeded)):
+        pages = cte_names(sql)
+        for line in plan:
+            scan = FULL_SCAN.match(line)
+            assert not (scan and scan.group(1) not in pages), f'{line} in:\n{sql}'
+            assert 'AUTOMATIC' not in line, f'{line} in:\n{sql}'
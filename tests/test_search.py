@@ -0,0 +1,20 @@
+"""Search filters are applied by the server, before paging."""
+
+
+def test_filters_apply_before_the_page_limit(api, client, make_user, make_ad):
+    seller = make_user('seller')
+    for i in range(5):
+        make_ad(seller, title=f'Saffron lot {i}', category='Others', tags=['bulk'])
+    wanted = {make_ad(seller, title='Saffron threads', category='Spices', tags=['premium']),
+              make_ad(seller, title='Saffron powder', category='Foods', tags=['premium'])}
+
+    def ids(query):
+        return {ad['id'] for ad in api('GET', f'/api/search?q=saffron&limit=2&fields=title&{query}')}
+
+    assert ids('category=Spices&category=Foods') == wanted
+    assert ids('tag=premium') == wanted
+    assert ids('tag=premium&maxPrice=1') == set()
+
+    first = client.get('/api/search?q=saffron&limit=4&category=Others')
+    second = client.get(f'/api/search?q=saffron&limit=4&category=Others&cursor={first.headers["X-Next-Cursor"]}')
+    assert len(first.get_json()) + len(second.get_json()) == 5